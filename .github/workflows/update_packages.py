@@ -8,12 +8,12 @@ import subprocess
 def has_changes() -> bool:
     """Returns True if there are changes in the working tree."""
     print("Detecting changes")
-    result = subprocess.run(["git", "diff", "--exit-code"], check=False)
+    result = subprocess.run(["git", "diff", "--quiet"], check=False)
     return result.returncode != 0
 
 
 def main():
-    random_name = "".join(random.choice("1234567890") for _ in range(9))
+    random_name = f"{random.randrange(1_000_000_000):09d}"
     branch_name = f"version-updater/pkg-{random_name}"
 
     print(f"Creating branch {branch_name}")
@@ -23,50 +23,62 @@ def get_next_even_number(number: int) -> int:
 
 def main():
     package_json = pathlib.Path("package.json")
-    package = json.loads(package_json.read_text(encoding="utf-8"))
-    version = package["version"].split(".")
+    package = json.loads(package_json.read_bytes())
+    # Convert the version parts to integers once, dropping any `-dev` suffix.
+    major, minor, micro = (
+        int(part.partition("-")[0]) for part in package["version"].split(".")
+    )
+    suffix = ""
     release_type = os.getenv("RELEASE_TYPE", sys.argv[-1])
     if release_type == "release":
-        year = str(datetime.now().year)
-        if year == version[0]:
+        year = datetime.now().year
+        if year == major:
             # If year is the same only update minor
-            version[1] = str(get_next_even_number(int(version[1])))
+            minor = get_next_even_number(minor)
         else:
             # If new year, update major and reset minor
-            version[0] = year
-            version[1] = "0"
-        version[2] = "0"
+            major = year
+            minor = 0
+        micro = 0
     elif release_type == "pre-release":
         # For pre-release we don't bump major
-        version[1] = str(get_next_odd_number(int(version[2])))
-        version[2] = "0-dev"
+        minor = get_next_odd_number(minor)
+        micro = 0
+        suffix = "-dev"
     elif release_type == "hotfix":
         # For hotfix we don't bump major or minor
-        version[2] = str(int(version[2]) + 1)
+        micro += 1
     else:
         print("Unknown release type, skipping version update.")
         exit(1)
 
-    package["version"] = ".".join(version)
-    random_name = "".join(random.choice("1234567890") for _ in range(9))
+    package["version"] = f"{major}.{minor}.{micro}{suffix}"
+    random_name = f"{random.randrange(1_000_000_000):09d}"
     branch_name = f"version-updater/ext-{package['version']}-{random_name}"
 
     print(f"Creating branch {branch_name}")
     subprocess.run(["git", "switch", "--create", branch_name], check=True)
 
     print(f"Updating build TO: {package['version']}")
-    package_json.write_text(
-        json.dumps(package, indent=4, ensure_ascii=False) + "\n", encoding="utf-8"
-    )
+    with package_json.open("w", encoding="utf-8") as f:
+        json.dump(package, f, indent=4, ensure_ascii=False)
+        f.write("\n")
 
     print("Running npm install")
-    subprocess.run(["npm", "install"], check=True, shell=True)
+    npm = "npm.cmd" if os.name == "nt" else "npm"
+    subprocess.run([npm, "install"], check=True)
 
     print("Committing changes")
-    subprocess.run(["git", "add", "package.json"], check=True)
-    subprocess.run(["git", "add", "package-lock.json"], check=True)
     subprocess.run(
-        ["git", "commit", "-m", f"Update extension version to {package['version']}"],
+        [
+            "git",
+            "commit",
+            "-m",
+            f"Update extension version to {package['version']}",
+            "--",
+            "package.json",
+            "package-lock.json",
+        ],
         check=True,
     )
 
@@ -1,19 +1,34 @@
 # Copyright (c) Microsoft Corporation. All rights reserved.
 # Licensed under the MIT License.
 
+import datetime
 import json
+import pathlib
 
-import freezegun
 import pytest
 import update_ext_version
 
-TEST_DATETIME = "2022-03-14 01:23:45"
+TEST_DATETIME = datetime.datetime(2022, 3, 14, 1, 23, 45)
 
 # The build ID is calculated via:
-#     "1" + datetime.datetime.strptime(TEST_DATETIME,"%Y-%m-%d %H:%M:%S").strftime('%j%H%M')
+#     "1" + TEST_DATETIME.strftime('%j%H%M')
 EXPECTED_BUILD_ID = "10730123"
 
 
+class FrozenDateTime(datetime.datetime):
+    """`datetime.datetime` with `now()` fixed to `TEST_DATETIME`."""
+
+    @classmethod
+    def now(cls, tz=None):
+        return TEST_DATETIME.replace(tzinfo=tz)
+
+
+@pytest.fixture(autouse=True)
+def freeze_time(monkeypatch):
+    """Freeze the time seen by `update_ext_version`."""
+    monkeypatch.setattr(update_ext_version, "datetime", FrozenDateTime)
+
+
 def create_package_json(directory, version):
     """Create `package.json` in `directory` with a specified version of `version`."""
     package_json = directory / "package.json"
@@ -24,7 +39,7 @@ def create_package_json(directory, version):
 def run_test(tmp_path, version, args, expected):
     package_json = create_package_json(tmp_path, version)
     update_ext_version.main(package_json, args)
-    package = json.loads(package_json.read_text(encoding="utf-8"))
+    package = json.loads(pathlib.Path(package_json).read_text(encoding="utf-8"))
     assert expected == update_ext_version.parse_version(package["version"])
 
 
@@ -99,6 +114,23 @@ def test_invalid_args(tmp_path, version, args):
         ),
     ],
 )
-@freezegun.freeze_time("2022-03-14 01:23:45")
 def test_update_ext_version(tmp_path, version, args, expected):
     run_test(tmp_path, version, args, expected)
+
+
+@pytest.mark.parametrize(
+    "version, expected",
+    [
+        ("1.0.0", ("1", "0", "0", "")),
+        ("2024.1.12345-dev", ("2024", "1", "12345", "dev")),
+        ("1.1.0-rc-1", ("1", "1", "0", "rc-1")),
+    ],
+)
+def test_parse_version(version, expected):
+    assert expected == update_ext_version.parse_version(version)
+
+
+@pytest.mark.parametrize("version", ["1.0", "1.0.0-", "a.b.c"])
+def test_parse_version_invalid(version):
+    with pytest.raises(ValueError):
+        update_ext_version.parse_version(version)
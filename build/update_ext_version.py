@@ -2,15 +2,21 @@
 # Licensed under the MIT License.
 
 import argparse
-import datetime
+import functools
 import json
+import os
 import pathlib
+import re
 import sys
+from datetime import datetime, timezone
 from typing import Sequence, Tuple, Union
 
 EXT_ROOT = pathlib.Path(__file__).parent.parent
 PACKAGE_JSON_PATH = EXT_ROOT / "package.json"
 
+# Matches `<major>.<minor>.<micro>[-<suffix>]`.
+VERSION_RE = re.compile(r"(\d+)\.(\d+)\.(\d+)(?:-(.+))?")
+
 
 def build_arg_parse() -> argparse.ArgumentParser:
     """Builds the arguments parser."""
@@ -47,25 +53,49 @@ def micro_build_number() -> str:
     """Generates the micro build number.
     The format is `1<Julian day><hour><minute>`.
     """
-    return f"1{datetime.datetime.now(tz=datetime.timezone.utc).strftime('%j%H%M')}"
+    return f"1{datetime.now(tz=timezone.utc).strftime('%j%H%M')}"
 
 
 def parse_version(version: str) -> Tuple[str, str, str, str]:
     """Parse a version string into a tuple of version parts."""
-    major, minor, parts = version.split(".", maxsplit=2)
-    try:
-        micro, suffix = parts.split("-", maxsplit=1)
-    except ValueError:
-        micro = parts
-        suffix = ""
+    match = VERSION_RE.fullmatch(version)
+    if match is None:
+        raise ValueError(f"Invalid version: {version}")
+    major, minor, micro, suffix = match.groups(default="")
     return major, minor, micro, suffix
 
 
+@functools.lru_cache(maxsize=16)
+def _load_package_cached(path: str, mtime_ns: int, size: int) -> dict:
+    """Parses `package.json`, cached by path, modified time and size."""
+    return json.loads(pathlib.Path(path).read_bytes())
+
+
+def load_package(package_json: pathlib.Path) -> dict:
+    """Returns the parsed contents of `package_json`.
+
+    The parsed data is reused while the file is unchanged on disk. A shallow
+    copy is returned so callers can update top level keys like `version`.
+    """
+    stat = package_json.stat()
+    return dict(
+        _load_package_cached(os.fspath(package_json), stat.st_mtime_ns, stat.st_size)
+    )
+
+
+def _write_package(package_json: pathlib.Path, package: dict) -> None:
+    """Writes `package` to `package_json` with a new-line at the end of the file."""
+    with package_json.open("w", encoding="utf-8") as f:
+        json.dump(package, f, indent=4, ensure_ascii=False)
+        f.write("\n")
+    _load_package_cached.cache_clear()
+
+
 def main(package_json: pathlib.Path, argv: Sequence[str]) -> None:
     parser = build_arg_parse()
     args = parser.parse_args(argv)
 
-    package = json.loads(package_json.read_text(encoding="utf-8"))
+    package = load_package(package_json)
 
     major, minor, micro, suffix = parse_version(package["version"])
 
@@ -78,7 +108,8 @@ def main(package_json: pathlib.Path, argv: Sequence[str]) -> None:
             f"Pre-Release version should have ODD numbered minor version: {package['version']}"
         )
 
-    print(f"Updating build FROM: {package['version']}")
+    old_version = package["version"]
+    print(f"Updating build FROM: {old_version}")
     if args.build_id:
         # If build id is provided it should fall within the 0-INT32 max range
         # that the max allowed value for publishing to the Marketplace.
@@ -98,10 +129,9 @@ def main(package_json: pathlib.Path, argv: Sequence[str]) -> None:
         package["version"] += "-" + suffix
     print(f"Updating build TO: {package['version']}")
 
-    # Overwrite package.json with new data add a new-line at the end of the file.
-    package_json.write_text(
-        json.dumps(package, indent=4, ensure_ascii=False) + "\n", encoding="utf-8"
-    )
+    # package.json is parsed once above, only write it back if the version changed.
+    if package["version"] != old_version:
+        _write_package(package_json, package)
 
 
 if __name__ == "__main__":
@@ -4,22 +4,166 @@
 
 import bisect
 import difflib
-from threading import Thread
-from typing import List, Optional
+import functools
+import itertools
+import time
+from typing import Callable, List, Optional, Tuple
 
 from lsprotocol import types as lsp
-from pygls.workspace.position_codec import PositionCodec
+
+try:
+    # rapidfuzz is what newer versions of python-Levenshtein are built on.
+    from rapidfuzz.distance import Levenshtein
+except ImportError:
+    try:
+        import Levenshtein
+    except ImportError:
+        Levenshtein = None
 
 DIFF_TIMEOUT = 1  # 1 second
+# Changed blocks longer than this are replaced as whole lines by the difflib
+# fallback, instead of being compared character by character.
+LINE_DIFF_THRESHOLD = 4096
+# Levenshtein cannot be stopped at the deadline, and its run time grows with the
+# product of the lengths of the texts. Larger diffs, which take about a second
+# or more, are replaced as a whole instead.
+LEVENSHTEIN_MAX_SIZE = 10**10
 
 
-def _get_diff(old_text: str, new_text: str):
-    try:
-        import Levenshtein
+def _common_prefix_length(a: str, b: str) -> int:
+    """Returns the length of the common prefix of `a` and `b`."""
+    # Binary search using slice comparisons, which run in C, instead of
+    # comparing one character at a time in Python.
+    low, high = 0, min(len(a), len(b))
+    while low < high:
+        mid = (low + high + 1) // 2
+        if a[low:mid] == b[low:mid]:
+            low = mid
+        else:
+            high = mid - 1
+    return low
+
+
+def _common_suffix_length(a: str, b: str, limit: int) -> int:
+    """Returns the length of the common suffix of `a` and `b`, up to `limit`."""
+    len_a, len_b = len(a), len(b)
+    low, high = 0, limit
+    while low < high:
+        mid = (low + high + 1) // 2
+        if a[len_a - mid : len_a - low] == b[len_b - mid : len_b - low]:
+            low = mid
+        else:
+            high = mid - 1
+    return low
+
+
+def _get_opcodes(old_text: str, new_text: str, deadline: float):
+    if Levenshtein is not None:
+        if (
+            time.monotonic() > deadline
+            or len(old_text) * len(new_text) > LEVENSHTEIN_MAX_SIZE
+        ):
+            return None
+        opcodes = Levenshtein.opcodes(old_text, new_text)
+        if time.monotonic() > deadline:
+            return None
+        return opcodes
+
+    # difflib runs in Python, so diff the lines first and only compare the
+    # characters of changed lines that are not too long. This also lets the
+    # deadline be checked between blocks, returning None if it has passed.
+    old_lines = old_text.splitlines(True)
+    new_lines = new_text.splitlines(True)
+    old_offsets = list(itertools.accumulate(map(len, old_lines), initial=0))
+    new_offsets = list(itertools.accumulate(map(len, new_lines), initial=0))
+
+    opcodes = []
+    matcher = difflib.SequenceMatcher(a=old_lines, b=new_lines)
+    for tag, old_first, old_last, new_first, new_last in matcher.get_opcodes():
+        old_start, old_stop = old_offsets[old_first], old_offsets[old_last]
+        new_start, new_stop = new_offsets[new_first], new_offsets[new_last]
+        if (
+            tag != "replace"
+            or max(old_stop - old_start, new_stop - new_start) > LINE_DIFF_THRESHOLD
+        ):
+            opcodes.append((tag, old_start, old_stop, new_start, new_stop))
+            continue
+
+        if time.monotonic() > deadline:
+            return None
+        for tag, old_from, old_to, new_from, new_to in difflib.SequenceMatcher(
+            a=old_text[old_start:old_stop], b=new_text[new_start:new_stop]
+        ).get_opcodes():
+            opcodes.append(
+                (
+                    tag,
+                    old_from + old_start,
+                    old_to + old_start,
+                    new_from + new_start,
+                    new_to + new_start,
+                )
+            )
+    return opcodes
 
-        return Levenshtein.opcodes(old_text, new_text)
-    except ImportError:
-        return difflib.SequenceMatcher(a=old_text, b=new_text).get_opcodes()
+
+def _get_diff(old_text: str, new_text: str, deadline: float):
+    # Formatting usually changes a small part of the document, so only diff
+    # the text between the common prefix and the common suffix.
+    prefix = _common_prefix_length(old_text, new_text)
+    suffix = _common_suffix_length(
+        old_text, new_text, min(len(old_text), len(new_text)) - prefix
+    )
+    old_end = len(old_text) - suffix
+    new_end = len(new_text) - suffix
+
+    middle = _get_opcodes(old_text[prefix:old_end], new_text[prefix:new_end], deadline)
+    if middle is None:
+        return None
+
+    # The prefix and suffix are equal and produce no edits. Opcodes of the
+    # middle are moved back to offsets in the whole text as they are consumed,
+    # rather than copied into another list.
+    return (
+        (
+            tag,
+            old_start + prefix,
+            old_stop + prefix,
+            new_start + prefix,
+            new_stop + prefix,
+        )
+        for tag, old_start, old_stop, new_start, new_stop in middle
+    )
+
+
+def _get_code_units_counter(
+    position_encoding: lsp.PositionEncodingKind,
+) -> Callable[[str], int]:
+    """Returns a function that counts the code units of a string.
+
+    Counts match `PositionCodec.client_num_units`, but encoding the string is
+    done in C rather than checking each character in Python.
+    """
+
+    def utf16_units(text: str) -> int:
+        return len(text.encode("utf-16-le", "surrogatepass")) // 2
+
+    if position_encoding == lsp.PositionEncodingKind.Utf16:
+        return utf16_units
+    if position_encoding == lsp.PositionEncodingKind.Utf8:
+        # Same arithmetic as pygls: characters outside the BMP count as 3 units.
+        return lambda text: 2 * utf16_units(text) - len(text)
+    return len
+
+
+@functools.lru_cache(maxsize=4)
+def _get_lines(text: str) -> Tuple[Tuple[str, ...], Tuple[int, ...]]:
+    """Returns the lines of the text and the offset at which each line starts.
+
+    The same document is often formatted several times in a row, and strings
+    cache their hash, so repeated calls with the same text are cheap lookups.
+    """
+    lines = tuple(text.splitlines(True))
+    return lines, tuple(itertools.accumulate(map(len, lines), initial=0))
 
 
 def get_text_edits(
@@ -30,35 +174,39 @@ def get_text_edits(
 ) -> List[lsp.TextEdit]:
     """Return a list of text edits to transform old_text into new_text."""
 
-    lines = old_text.splitlines(True)
-    codec = PositionCodec(position_encoding)
+    lines, line_offsets = _get_lines(old_text)
+    code_units = _get_code_units_counter(position_encoding)
 
-    line_offsets = [0]
-    for line in lines:
-        line_offsets.append(line_offsets[-1] + len(line))
+    # Opcodes are ordered by offset and neighbouring opcodes share boundaries,
+    # so converted offsets are remembered and each line search resumes from the
+    # line found by the previous one.
+    positions = {}
+    last_line = 0
 
     def from_offset(offset: int) -> lsp.Position:
-        line = bisect.bisect_right(line_offsets, offset) - 1
-        character = offset - line_offsets[line]
-        return lsp.Position(line=line, character=character)
-
-    sequences = []
-    try:
-        thread = Thread(target=lambda: sequences.extend(_get_diff(old_text, new_text)))
-        thread.start()
-        thread.join(timeout or DIFF_TIMEOUT)
-    except Exception:
-        pass
+        nonlocal last_line
+        position = positions.get(offset)
+        if position is None:
+            if offset < line_offsets[last_line]:
+                last_line = 0
+            line = bisect.bisect_right(line_offsets, offset, last_line) - 1
+            last_line = line
+            character = offset - line_offsets[line]
+            if character:
+                # Convert from code points to the client's code units.
+                character = code_units(lines[line][:character])
+            position = positions[offset] = lsp.Position(line=line, character=character)
+        return position
 
-    if sequences:
+    sequences = _get_diff(
+        old_text, new_text, time.monotonic() + (timeout or DIFF_TIMEOUT)
+    )
+    if sequences is not None:
         edits = [
             lsp.TextEdit(
-                range=codec.range_to_client_units(
-                    lines=lines,
-                    range=lsp.Range(
-                        start=from_offset(old_start),
-                        end=from_offset(old_end),
-                    ),
+                range=lsp.Range(
+                    start=from_offset(old_start),
+                    end=from_offset(old_end),
                 ),
                 new_text=new_text[new_start:new_end],
             )
@@ -97,6 +97,7 @@ class JsonRpc:
     def __init__(self, reader: io.TextIOWrapper, writer: io.TextIOWrapper):
         self._reader = JsonReader(reader)
         self._writer = JsonWriter(writer)
+        self._lock = threading.Lock()
 
     def close(self):
         """Closes the underlying streams."""
@@ -117,6 +118,16 @@ class JsonRpc:
         """Receive data in JSON-RPC format."""
         return self._reader.read()
 
+    def send_request(self, data):
+        """Send given data and wait for its response.
+
+        Requests from different threads are serialized so that each one
+        reads back its own response.
+        """
+        with self._lock:
+            self._writer.write(data)
+            return self._reader.read()
+
 
 def create_json_rpc(readable: BinaryIO, writable: BinaryIO) -> JsonRpc:
     """Creates JSON-RPC wrapper for the readable and writable streams."""
@@ -176,27 +187,26 @@ class ProcessManager:
 
         self._thread_pool.submit(_monitor_process)
 
-    def get_json_rpc(self, workspace: str) -> JsonRpc:
-        """Gets the JSON-RPC wrapper for the a given id."""
+    def get_or_start_json_rpc(
+        self,
+        workspace: str,
+        args: Sequence[str],
+        cwd: str,
+        env: Optional[Dict[str, str]] = None,
+    ) -> Union[JsonRpc, None]:
+        """Gets the JSON-RPC wrapper for the workspace, starting the process if
+        needed. Requests run concurrently, so the check and the start are done
+        under one lock to start a single process per workspace."""
         with self._lock:
-            if workspace in self._rpc:
-                return self._rpc[workspace]
-        raise StreamClosedException()
+            if workspace not in self._rpc:
+                self.start_process(workspace, args, cwd, env)
+            return self._rpc.get(workspace)
 
 
 _process_manager = ProcessManager()
 atexit.register(_process_manager.stop_all_processes)
 
 
-def _get_json_rpc(workspace: str) -> Union[JsonRpc, None]:
-    try:
-        return _process_manager.get_json_rpc(workspace)
-    except StreamClosedException:
-        return None
-    except KeyError:
-        return None
-
-
 def get_or_start_json_rpc(
     workspace: str,
     interpreter: Sequence[str],
@@ -204,12 +214,8 @@ def get_or_start_json_rpc(
     env: Optional[Dict[str, str]] = None,
 ) -> Union[JsonRpc, None]:
     """Gets an existing JSON-RPC connection or starts one and return it."""
-    res = _get_json_rpc(workspace)
-    if not res:
-        args = [*interpreter, RUNNER_SCRIPT]
-        _process_manager.start_process(workspace, args, cwd, env)
-        res = _get_json_rpc(workspace)
-    return res
+    args = [*interpreter, RUNNER_SCRIPT]
+    return _process_manager.get_or_start_json_rpc(workspace, args, cwd, env)
 
 
 # pylint: disable=too-few-public-methods
@@ -250,9 +256,7 @@ def run_over_json_rpc(
     if source:
         msg["source"] = source
 
-    rpc.send_data(msg)
-
-    data = rpc.receive_data()
+    data = rpc.send_request(msg)
 
     if data["id"] != msg_id:
         return RpcRunResult(
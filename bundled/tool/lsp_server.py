@@ -4,13 +4,17 @@
 from __future__ import annotations
 
 import ast
-import copy
+import collections
+import concurrent.futures
+import functools
+import hashlib
 import json
 import os
 import pathlib
 import re
 import sys
 import sysconfig
+import threading
 import traceback
 from typing import Any, Dict, List, Optional, Sequence, Tuple
 
@@ -66,12 +70,19 @@ import lsp_io
 import lsp_jsonrpc as jsonrpc
 import lsp_utils as utils
 import lsprotocol.types as lsp
+from packaging.version import parse as parse_version
 from pygls import server, uris, workspace
 
 WORKSPACE_SETTINGS = {}
 GLOBAL_SETTINGS = {}
+# Workspace keys found for document paths, cleared when the workspaces change.
+DOCUMENT_KEYS: Dict[str, Optional[str]] = {}
+# Settings built from the global defaults for folders outside any workspace.
+NON_WORKSPACE_SETTINGS: Dict[str, Dict[str, Any]] = {}
 RUNNER = pathlib.Path(__file__).parent / "lsp_runner.py"
 
+# Formatting requests run on a thread pool of this size, so that a slow black
+# run does not hold up other requests.
 MAX_WORKERS = 5
 LSP_SERVER = server.LanguageServer(
     name="black-server", version="v0.1.0", max_workers=MAX_WORKERS
@@ -87,21 +98,51 @@ TOOL_DISPLAY = "Black Formatter"
 # Default arguments always passed to black.
 TOOL_ARGS = []
 
+# Extra arguments passed to black based on the file extension.
+ARGS_BY_FILE_EXTENSION = {
+    ".pyi": ("--pyi",),
+    ".ipynb": ("--ipynb",),
+}
+
 # Minimum version of black supported.
 MIN_VERSION = "22.3.0"
 
 # Minimum version of black that supports the `--line-ranges` CLI option.
 LINE_RANGES_MIN_VERSION = (23, 11, 0)
 
+# Matches version numbers, as words on their own, in `black --version` output.
+VERSION_RE = re.compile(r"(?<![^ ])\d+\.\d+\S*")
+
 # Versions of black found by workspace
 VERSION_LOOKUP: Dict[str, Tuple[int, int, int]] = {}
 
+# Recent black results, keyed by everything that can change black's output.
+FORMAT_CACHE_SIZE = 16
+FORMAT_CACHE: collections.OrderedDict = collections.OrderedDict()
+FORMAT_CACHE_LOCK = threading.Lock()
+# Keys of sources black left unchanged. These only need the key, not a copy of
+# the output, so many more of them are remembered.
+FORMATTED_SOURCES_SIZE = 1024
+FORMATTED_SOURCES: collections.OrderedDict = collections.OrderedDict()
+# Requests currently running black, keyed like FORMAT_CACHE. Identical requests
+# that arrive meanwhile wait for the result instead of running black again.
+FORMAT_PENDING: Dict[Tuple, concurrent.futures.Future] = {}
+# Modified times of the configuration files seen so far, by path. Black caches
+# the configuration files it reads for the life of the process, so when one of
+# them changes these caches are cleared for black running in-process.
+CONFIG_STAMPS: Dict[str, int] = {}
+
+# Serializes running black in-process, which swaps process wide state like
+# `sys.path` and the standard streams.
+IN_PROCESS_LOCK = threading.Lock()
+
 # **********************************************************
 # Formatting features start here
 # **********************************************************
 
 
 @LSP_SERVER.feature(lsp.TEXT_DOCUMENT_FORMATTING)
+@LSP_SERVER.thread()
 def formatting(params: lsp.DocumentFormattingParams) -> list[lsp.TextEdit] | None:
     """LSP handler for textDocument/formatting request."""
 
@@ -113,6 +154,7 @@ def formatting(params: lsp.DocumentFormattingParams) -> list[lsp.TextEdit] | Non
     lsp.TEXT_DOCUMENT_RANGE_FORMATTING,
     lsp.DocumentRangeFormattingOptions(ranges_support=True),
 )
+@LSP_SERVER.thread()
 def range_formatting(
     params: lsp.DocumentRangeFormattingParams,
 ) -> list[lsp.TextEdit] | None:
@@ -137,6 +179,7 @@ def range_formatting(
 
 
 @LSP_SERVER.feature(lsp.TEXT_DOCUMENT_RANGES_FORMATTING)
+@LSP_SERVER.thread()
 def ranges_formatting(
     params: lsp.DocumentRangesFormattingParams,
 ) -> list[lsp.TextEdit] | None:
@@ -157,12 +200,23 @@ def ranges_formatting(
         return _formatting_helper(document)
 
 
+@functools.lru_cache(maxsize=32)
+def _get_syntax_error(code: str, file_path: str) -> Optional[str]:
+    """Returns the syntax error traceback for the code, or None if it parses."""
+    try:
+        # Same as `ast.parse`, without the wrapper. Before Python 3.12 null bytes
+        # raise ValueError instead of SyntaxError.
+        compile(code, file_path, "exec", ast.PyCF_ONLY_AST, dont_inherit=True)
+    except (SyntaxError, ValueError):
+        return traceback.format_exc()
+    return None
+
+
 def is_python(code: str, file_path: str) -> bool:
     """Ensures that the code provided is python."""
-    try:
-        ast.parse(code, file_path)
-    except SyntaxError:
-        log_error(f"Syntax error in code: {traceback.format_exc()}")
+    error = _get_syntax_error(code, file_path)
+    if error:
+        log_error(f"Syntax error in code: {error}")
         return False
     return True
 
@@ -173,7 +227,9 @@ def _formatting_helper(
     args = [] if args is None else args
     extra_args = args + _get_args_by_file_extension(document)
     extra_args += ["--stdin-filename", _get_filename_for_black(document)]
-    result = _run_tool_on_document(document, use_stdin=True, extra_args=extra_args)
+    source = document.source
+
+    result = _run_tool_on_document_cached(document, source, extra_args)
     if result and result.stdout:
         if LSP_SERVER.lsp.trace == lsp.TraceValues.Verbose:
             log_to_output(
@@ -185,7 +241,7 @@ def _formatting_helper(
                 + "\r\n"
             )
 
-        new_source = _match_line_endings(document, result.stdout)
+        new_source = _match_line_endings(source, result.stdout)
 
         # Skip last line ending in a notebook cell
         if document.uri.startswith("vscode-notebook-cell"):
@@ -195,9 +251,9 @@ def _formatting_helper(
                 new_source = new_source[:-1]
 
         # If code is already formatted, then no need to send any edits.
-        if new_source != document.source:
+        if new_source != source:
             edits = edit_utils.get_text_edits(
-                document.source, new_source, lsp.PositionEncodingKind.Utf16
+                source, new_source, lsp.PositionEncodingKind.Utf16
             )
             if edits:
                 # NOTE: If you provide [] array, VS Code will clear the file of all contents.
@@ -206,6 +262,155 @@ def _formatting_helper(
     return None
 
 
+def _run_tool_on_document_cached(
+    document: workspace.Document, source: str, extra_args: List[str]
+) -> utils.RunResult | None:
+    """Runs black on the document, reusing recent and in-flight results."""
+    # A digest of the source keeps the cache from holding on to old copies of
+    # every document it has seen.
+    source_hash = hashlib.blake2b(
+        source.encode("utf-8", "surrogatepass"), digest_size=16
+    ).digest()
+    settings = _get_settings_by_document(document)
+    args = settings["args"] + extra_args
+    config_stamps = _get_config_stamps(document.path, args, get_cwd(settings, document))
+    cache_key = (
+        document.uri,
+        source_hash,
+        tuple(args),
+        # Results of another black version are not reused.
+        VERSION_LOOKUP.get(settings["workspaceFS"]),
+        config_stamps,
+    )
+    # With `path` black is started anew for every request, so an upgrade takes
+    # effect right away without changing the version found at start up. Only
+    # requests running at the same time share a result then.
+    keep_result = not settings["path"]
+    with FORMAT_CACHE_LOCK:
+        _update_config_stamps(config_stamps)
+        result = _get_cached_result(cache_key, source)
+        if result is None:
+            pending = FORMAT_PENDING.get(cache_key)
+            is_running = pending is not None
+            if not is_running:
+                pending = FORMAT_PENDING[cache_key] = concurrent.futures.Future()
+
+    if result is not None:
+        log_to_output(f"Using cached formatting result for: {document.uri}")
+        return result
+
+    if is_running:
+        # Bursts of identical requests, such as format on save right after a
+        # format command, share a single run of black.
+        log_to_output(f"Using in-flight formatting result for: {document.uri}")
+        return pending.result()
+
+    try:
+        result = _run_tool_on_document(
+            document, use_stdin=True, extra_args=extra_args, source=source
+        )
+    except BaseException as exc:
+        with FORMAT_CACHE_LOCK:
+            del FORMAT_PENDING[cache_key]
+        pending.set_exception(exc)
+        raise
+
+    with FORMAT_CACHE_LOCK:
+        if keep_result and result and result.stdout:
+            if result.stdout == source:
+                FORMATTED_SOURCES[cache_key] = None
+                if len(FORMATTED_SOURCES) > FORMATTED_SOURCES_SIZE:
+                    FORMATTED_SOURCES.popitem(last=False)
+            else:
+                FORMAT_CACHE[cache_key] = result
+                if len(FORMAT_CACHE) > FORMAT_CACHE_SIZE:
+                    FORMAT_CACHE.popitem(last=False)
+        del FORMAT_PENDING[cache_key]
+    pending.set_result(result)
+    return result
+
+
+def _get_cached_result(cache_key: Tuple, source: str) -> utils.RunResult | None:
+    """Returns a cached black result. Must be called with FORMAT_CACHE_LOCK held."""
+    if cache_key in FORMATTED_SOURCES:
+        # Black left this source unchanged last time.
+        FORMATTED_SOURCES.move_to_end(cache_key)
+        return utils.RunResult(source, "")
+    result = FORMAT_CACHE.get(cache_key)
+    if result is not None:
+        FORMAT_CACHE.move_to_end(cache_key)
+    return result
+
+
+def _get_config_stamps(
+    file_path: str, args: Sequence[str], cwd: str
+) -> Tuple[Tuple[str, int], ...]:
+    """Returns paths and modified times of the configuration files black could read.
+
+    Black looks for `pyproject.toml` in the parent directories of the file,
+    then for the user level configuration, unless `--config` names a file. A
+    cached result is only valid while none of these have changed.
+    """
+    paths = []
+    directory = os.path.dirname(file_path)
+    while True:
+        paths.append(os.path.join(directory, "pyproject.toml"))
+        parent = os.path.dirname(directory)
+        if parent == directory:
+            break
+        directory = parent
+
+    paths.append(_get_user_config_path())
+    for index, arg in enumerate(args):
+        if arg == "--config" and index + 1 < len(args):
+            config = args[index + 1]
+        elif arg.startswith("--config="):
+            config = arg[len("--config=") :]
+        else:
+            continue
+        paths.append(os.path.join(cwd, config))
+    return tuple((path, _get_mtime(path)) for path in paths)
+
+
+def _update_config_stamps(config_stamps: Tuple[Tuple[str, int], ...]) -> None:
+    """Records the configuration file stamps, clearing black's caches if any
+    file changed. Must be called with FORMAT_CACHE_LOCK held."""
+    changed = False
+    for path, stamp in config_stamps:
+        if CONFIG_STAMPS.setdefault(path, stamp) != stamp:
+            CONFIG_STAMPS[path] = stamp
+            changed = True
+    if changed:
+        _clear_tool_config_cache()
+
+
+def _clear_tool_config_cache() -> None:
+    """Makes black running in-process read its configuration files again."""
+    files = sys.modules.get(f"{TOOL_MODULE}.files")
+    for name in ("find_project_root", "_load_toml"):
+        cache_clear = getattr(getattr(files, name, None), "cache_clear", None)
+        if cache_clear is not None:
+            cache_clear()
+
+
+def _get_user_config_path() -> str:
+    """Returns the path of black's user level configuration file."""
+    if sys.platform == "win32":
+        return os.path.join(os.path.expanduser("~"), ".black")
+    config_root = os.environ.get("XDG_CONFIG_HOME") or os.path.join(
+        os.path.expanduser("~"), ".config"
+    )
+    return os.path.join(config_root, "black")
+
+
+def _get_mtime(file_path: str) -> int:
+    """Returns the modified time of the file, or 0 if it cannot be read."""
+    try:
+        return os.stat(file_path).st_mtime_ns
+    except OSError:
+        return 0
+
+
 def _get_filename_for_black(document: workspace.Document) -> str:
     """Gets or generates a file name to use with black when formatting."""
     if document.uri.startswith("vscode-notebook-cell") and document.path.endswith(
@@ -216,20 +421,21 @@ def _get_filename_for_black(document: workspace.Document) -> str:
     return document.path
 
 
-def _get_line_endings(lines: list[str]) -> str:
+def _get_line_endings(text: str) -> str | None:
     """Returns line endings used in the text."""
-    try:
-        if lines[0][-2:] == "\r\n":
-            return "\r\n"
-        return "\n"
-    except Exception:  # pylint: disable=broad-except
+    if not text:
         return None
+    # Only the first line ending is checked, no need to split the whole text.
+    index = text.find("\n")
+    if index > 0 and text[index - 1] == "\r":
+        return "\r\n"
+    return "\n"
 
 
-def _match_line_endings(document: workspace.Document, text: str) -> str:
+def _match_line_endings(source: str, text: str) -> str:
     """Ensures that the edited text line endings matches the document line endings."""
-    expected = _get_line_endings(document.source.splitlines(keepends=True))
-    actual = _get_line_endings(text.splitlines(keepends=True))
+    expected = _get_line_endings(source)
+    actual = _get_line_endings(text)
     if actual == expected or actual is None or expected is None:
         return text
     return text.replace(actual, expected)
@@ -240,14 +446,9 @@ def _get_args_by_file_extension(document: workspace.Document) -> List[str]:
     if document.uri.startswith("vscode-notebook-cell"):
         return []
 
-    p = document.path.lower()
-    if p.endswith(".py"):
-        return []
-    elif p.endswith(".pyi"):
-        return ["--pyi"]
-    elif p.endswith(".ipynb"):
-        return ["--ipynb"]
-    return []
+    # Only lower case the extension, not the whole path.
+    extension = os.path.splitext(document.path)[1].lower()
+    return list(ARGS_BY_FILE_EXTENSION.get(extension, ()))
 
 
 # **********************************************************
@@ -292,14 +493,36 @@ def on_shutdown(_params: Optional[Any] = None) -> None:
     jsonrpc.shutdown_json_rpc()
 
 
+def _get_runner_key(settings: Dict[str, Any]) -> Tuple:
+    """Returns the settings that decide how black is run for `--version`.
+
+    A relative `path` or `interpreter` is found from the `cwd`, so workspaces
+    only share a version check when all of these are the same.
+    """
+    return (
+        tuple(settings.get("path", [])),
+        tuple(settings.get("interpreter", [])),
+        settings.get("importStrategy"),
+        get_cwd(settings, None),
+    )
+
+
 def _update_workspace_settings_with_version_info(
     workspace_settings: dict[str, Any]
 ) -> None:
+    # Workspaces that run black the same way share the result of `--version`,
+    # and different ways of running black are started at the same time.
+    with concurrent.futures.ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        probes: Dict[Tuple, concurrent.futures.Future] = {}
+        for settings in workspace_settings.values():
+            runner = _get_runner_key(settings)
+            if runner not in probes:
+                probes[runner] = executor.submit(_run_tool, ["--version"], settings)
+
+    min_version = parse_version(MIN_VERSION)
     for settings in workspace_settings.values():
         try:
-            from packaging.version import parse as parse_version
-
-            result = _run_tool(["--version"], copy.deepcopy(settings))
+            result = probes[_get_runner_key(settings)].result()
             code_workspace = settings["workspaceFS"]
             log_to_output(
                 f"Version info for formatter running for {code_workspace}:\r\n{result.stdout}"
@@ -312,15 +535,14 @@ def _update_workspace_settings_with_version_info(
 
             # This is text we get from running `black --version`
             # black, 22.3.0 (compiled: yes) <--- This is the version we want.
-            first_line = result.stdout.splitlines(keepends=False)[0]
-            parts = [v for v in first_line.split(" ") if re.match(r"\d+\.\d+\S*", v)]
+            first_line = result.stdout.partition("\n")[0]
+            parts = VERSION_RE.findall(first_line.rstrip("\r"))
             if len(parts) == 1:
                 actual_version = parts[0]
             else:
                 actual_version = "0.0.0"
 
             version = parse_version(actual_version)
-            min_version = parse_version(MIN_VERSION)
             VERSION_LOOKUP[code_workspace] = (
                 version.major,
                 version.minor,
@@ -359,6 +581,12 @@ def _get_global_defaults():
 
 
 def _update_workspace_settings(settings):
+    with FORMAT_CACHE_LOCK:
+        FORMAT_CACHE.clear()
+        FORMATTED_SOURCES.clear()
+    DOCUMENT_KEYS.clear()
+    NON_WORKSPACE_SETTINGS.clear()
+
     if not settings:
         key = utils.normalize_path(os.getcwd())
         WORKSPACE_SETTINGS[key] = {
@@ -378,11 +606,11 @@ def _update_workspace_settings(settings):
 
 
 def _get_settings_by_path(file_path: pathlib.Path):
-    workspaces = {s["workspaceFS"] for s in WORKSPACE_SETTINGS.values()}
-
+    # WORKSPACE_SETTINGS is keyed by `workspaceFS`, so it doubles as the lookup
+    # table for workspace folders.
     while file_path != file_path.parent:
         str_file_path = utils.normalize_path(file_path)
-        if str_file_path in workspaces:
+        if str_file_path in WORKSPACE_SETTINGS:
             return WORKSPACE_SETTINGS[str_file_path]
         file_path = file_path.parent
 
@@ -391,14 +619,27 @@ def _get_settings_by_path(file_path: pathlib.Path):
 
 
 def _get_document_key(document: workspace.Document):
+    try:
+        return DOCUMENT_KEYS[document.path]
+    except KeyError:
+        pass
+
+    key = _find_document_key(document)
+    DOCUMENT_KEYS[document.path] = key
+    return key
+
+
+def _find_document_key(document: workspace.Document):
     if WORKSPACE_SETTINGS:
         document_workspace = pathlib.Path(document.path)
-        workspaces = {s["workspaceFS"] for s in WORKSPACE_SETTINGS.values()}
 
-        # Find workspace settings for the given file.
+        # Find workspace settings for the given file. WORKSPACE_SETTINGS is keyed
+        # by `workspaceFS`, so each step is a single dict lookup. Each parent is
+        # resolved on its own, so a symlinked file inside a workspace is matched
+        # to that workspace rather than to the folder of its target.
         while document_workspace != document_workspace.parent:
             norm_path = utils.normalize_path(document_workspace)
-            if norm_path in workspaces:
+            if norm_path in WORKSPACE_SETTINGS:
                 return norm_path
             document_workspace = document_workspace.parent
 
@@ -413,12 +654,15 @@ def _get_settings_by_document(document: workspace.Document | None):
     if key is None:
         # This is either a non-workspace file or there is no workspace.
         key = utils.normalize_path(pathlib.Path(document.path).parent)
-        return {
-            "cwd": key,
-            "workspaceFS": key,
-            "workspace": uris.from_fs_path(key),
-            **_get_global_defaults(),
-        }
+        settings = NON_WORKSPACE_SETTINGS.get(key)
+        if settings is None:
+            settings = NON_WORKSPACE_SETTINGS[key] = {
+                "cwd": key,
+                "workspaceFS": key,
+                "workspace": uris.from_fs_path(key),
+                **_get_global_defaults(),
+            }
+        return settings
 
     return WORKSPACE_SETTINGS[str(key)]
 
@@ -439,51 +683,66 @@ def get_cwd(settings: Dict[str, Any], document: Optional[workspace.Document]) ->
     return settings["cwd"]
 
 
+def _get_tool_argv(settings: Dict[str, Any]) -> Tuple[List[str], bool, bool]:
+    """Returns the command used to run the tool, and how it should be run.
+
+    The result is `(argv, use_path, use_rpc)`. The returned `argv` is a new
+    list, so callers can extend it without changing the settings.
+    """
+    if settings["path"]:
+        # 'path' setting takes priority over everything.
+        return list(settings["path"]), True, False
+
+    if settings["interpreter"] and not utils.is_current_interpreter(
+        settings["interpreter"][0]
+    ):
+        # If there is a different interpreter set use JSON-RPC to the subprocess
+        # running under that interpreter.
+        return [TOOL_MODULE], False, True
+
+    # if the interpreter is same as the interpreter running this
+    # process then run as module.
+    return [TOOL_MODULE], False, False
+
+
 # pylint: disable=too-many-branches
 def _run_tool_on_document(
     document: workspace.Document,
     use_stdin: bool = False,
     extra_args: Sequence[str] = [],
+    source: Optional[str] = None,
 ) -> utils.RunResult | None:
     """Runs tool on the given document.
 
     if use_stdin is true then contents of the document is passed to the
-    tool via stdin.
+    tool via stdin. `source` is the text to format when the caller has
+    already read it from the document; the document can change in between.
     """
     if utils.is_stdlib_file(document.path):
         log_warning(f"Skipping standard library file: {document.path}")
         return None
 
-    if not is_python(document.source, document.path):
+    if source is None:
+        source = document.source
+
+    # For files black reports syntax errors itself, and can parse syntax newer
+    # than the interpreter running this server. Notebook cells are checked here
+    # since they often hold non python code like IPython magics.
+    if document.uri.startswith("vscode-notebook-cell") and not is_python(
+        source, document.path
+    ):
         log_warning(
             f"Skipping non python code or code with syntax errors: {document.path}"
         )
         return None
 
-    # deep copy here to prevent accidentally updating global settings.
-    settings = copy.deepcopy(_get_settings_by_document(document))
+    # Settings are shared with other requests, they must not be modified here.
+    settings = _get_settings_by_document(document)
 
     code_workspace = settings["workspaceFS"]
     cwd = get_cwd(settings, document)
 
-    use_path = False
-    use_rpc = False
-    if settings["path"]:
-        # 'path' setting takes priority over everything.
-        use_path = True
-        argv = settings["path"]
-    elif settings["interpreter"] and not utils.is_current_interpreter(
-        settings["interpreter"][0]
-    ):
-        # If there is a different interpreter set use JSON-RPC to the subprocess
-        # running under that interpreter.
-        argv = [TOOL_MODULE]
-        use_rpc = True
-    else:
-        # if the interpreter is same as the interpreter running this
-        # process then run as module.
-        argv = [TOOL_MODULE]
-
+    argv, use_path, use_rpc = _get_tool_argv(settings)
     argv += TOOL_ARGS + settings["args"] + extra_args
 
     if use_stdin:
@@ -497,7 +756,7 @@ def _run_tool_on_document(
             argv=argv,
             use_stdin=use_stdin,
             cwd=cwd,
-            source=document.source.replace("\r\n", "\n"),
+            source=source.replace("\r\n", "\n"),
         )
         if result.stderr:
             log_to_output(result.stderr)
@@ -514,7 +773,7 @@ def _run_tool_on_document(
             argv=argv,
             use_stdin=use_stdin,
             cwd=cwd,
-            source=document.source,
+            source=source,
             env={
                 "LS_IMPORT_STRATEGY": settings["importStrategy"],
             },
@@ -526,14 +785,15 @@ def _run_tool_on_document(
         log_to_output(f"CWD formatter: {cwd}")
         # This is needed to preserve sys.path, in cases where the tool modifies
         # sys.path and that might not work for this scenario next time around.
-        with utils.substitute_attr(sys, "path", [""] + sys.path[:]):
+        # Requests run on a thread pool, so only one thread may swap it at a time.
+        with IN_PROCESS_LOCK, utils.substitute_attr(sys, "path", [""] + sys.path[:]):
             try:
                 result = utils.run_module(
                     module=TOOL_MODULE,
                     argv=argv,
                     use_stdin=use_stdin,
                     cwd=cwd,
-                    source=document.source,
+                    source=source,
                 )
             except Exception:
                 log_error(traceback.format_exc(chain=True))
@@ -549,24 +809,7 @@ def _run_tool(extra_args: Sequence[str], settings: Dict[str, Any]) -> utils.RunR
     code_workspace = settings["workspaceFS"]
     cwd = get_cwd(settings, None)
 
-    use_path = False
-    use_rpc = False
-    if len(settings["path"]) > 0:
-        # 'path' setting takes priority over everything.
-        use_path = True
-        argv = settings["path"]
-    elif len(settings["interpreter"]) > 0 and not utils.is_current_interpreter(
-        settings["interpreter"][0]
-    ):
-        # If there is a different interpreter set use JSON-RPC to the subprocess
-        # running under that interpreter.
-        argv = [TOOL_MODULE]
-        use_rpc = True
-    else:
-        # if the interpreter is same as the interpreter running this
-        # process then run as module.
-        argv = [TOOL_MODULE]
-
+    argv, use_path, use_rpc = _get_tool_argv(settings)
     argv += extra_args
 
     if use_path:
@@ -599,7 +842,8 @@ def _run_tool(extra_args: Sequence[str], settings: Dict[str, Any]) -> utils.RunR
         log_to_output(f"CWD formatter: {cwd}")
         # This is needed to preserve sys.path, in cases where the tool modifies
         # sys.path and that might not work for this scenario next time around.
-        with utils.substitute_attr(sys, "path", [""] + sys.path[:]):
+        # Requests run on a thread pool, so only one thread may swap it at a time.
+        with IN_PROCESS_LOCK, utils.substitute_attr(sys, "path", [""] + sys.path[:]):
             try:
                 result = utils.run_module(
                     module=TOOL_MODULE, argv=argv, use_stdin=True, cwd=cwd
@@ -630,6 +874,12 @@ def _to_run_result_with_logging(rpc_result: jsonrpc.RpcRunResult) -> utils.RunRe
 # *****************************************************
 # Logging and notification.
 # *****************************************************
+# Values of `LS_SHOW_NOTIFICATION` that show a notification for each log level.
+_NOTIFY_ON_ERROR = frozenset({"onError", "onWarning", "always"})
+_NOTIFY_ON_WARNING = frozenset({"onWarning", "always"})
+_NOTIFY_ALWAYS = frozenset({"always"})
+
+
 def log_to_output(
     message: str, msg_type: lsp.MessageType = lsp.MessageType.Log
 ) -> None:
@@ -640,21 +890,21 @@ def log_to_output(
 def log_error(message: str) -> None:
     """Logs messages with notification on error."""
     LSP_SERVER.show_message_log(message, lsp.MessageType.Error)
-    if os.getenv("LS_SHOW_NOTIFICATION", "off") in ["onError", "onWarning", "always"]:
+    if os.getenv("LS_SHOW_NOTIFICATION", "off") in _NOTIFY_ON_ERROR:
         LSP_SERVER.show_message(message, lsp.MessageType.Error)
 
 
 def log_warning(message: str) -> None:
     """Logs messages with notification on warning."""
     LSP_SERVER.show_message_log(message, lsp.MessageType.Warning)
-    if os.getenv("LS_SHOW_NOTIFICATION", "off") in ["onWarning", "always"]:
+    if os.getenv("LS_SHOW_NOTIFICATION", "off") in _NOTIFY_ON_WARNING:
         LSP_SERVER.show_message(message, lsp.MessageType.Warning)
 
 
 def log_always(message: str) -> None:
     """Logs messages with notification."""
     LSP_SERVER.show_message_log(message, lsp.MessageType.Info)
-    if os.getenv("LS_SHOW_NOTIFICATION", "off") in ["always"]:
+    if os.getenv("LS_SHOW_NOTIFICATION", "off") in _NOTIFY_ALWAYS:
         LSP_SERVER.show_message(message, lsp.MessageType.Info)
 
 
@@ -4,6 +4,8 @@
 from __future__ import annotations
 
 import contextlib
+import functools
+import importlib
 import io
 import os
 import pathlib
@@ -19,6 +21,12 @@ from typing import Any, Callable, List, Sequence, Tuple, Union
 SERVER_CWD = os.getcwd()
 CWD_LOCK = threading.Lock()
 
+# Functions called by `python -m <module>`, by module. These are called directly
+# instead of having runpy find and execute the module's `__main__` every run.
+MAIN_FUNCTIONS = {
+    "black": ("black", "patched_main"),
+}
+
 
 def as_list(content: Union[Any, List[Any], Tuple[Any]]) -> List[Any]:
     """Ensures we always get a list"""
@@ -76,10 +84,22 @@ def is_current_interpreter(executable) -> bool:
     return is_same_path(executable, sys.executable)
 
 
+@functools.lru_cache(maxsize=512)
 def is_stdlib_file(file_path: str) -> bool:
-    """Return True if the file belongs to the standard library."""
-    normalized_path = str(pathlib.Path(file_path).resolve())
-    return any(normalized_path.startswith(path) for path in _stdlib_paths)
+    """Return True if the file belongs to the standard library.
+
+    Results are cached, the set of library paths does not change while the
+    server is running.
+    """
+    # Look up each parent directory in the set, rather than comparing the path
+    # against every library path.
+    path = str(pathlib.Path(file_path).resolve())
+    while path not in _stdlib_paths:
+        parent = os.path.dirname(path)
+        if parent == path:
+            return False
+        path = parent
+    return True
 
 
 # pylint: disable-next=too-few-public-methods
@@ -92,23 +112,70 @@ class RunResult:
 
 
 class CustomIO(io.TextIOWrapper):
-    """Custom stream object to replace stdio."""
+    """Custom stream object to replace stdio.
+
+    This is backed by bytes rather than being a `StringIO`, because black reads
+    and writes `sys.stdin.buffer` and `sys.stdout.buffer` directly.
+    """
 
     name = None
 
     def __init__(self, name, encoding="utf-8", newline=None):
         self._buffer = io.BytesIO()
         self._buffer.name = name
+        self._translate_newlines = newline is None
         super().__init__(self._buffer, encoding=encoding, newline=newline)
 
     def close(self):
         """Provide this close method which is used by some tools."""
         # This is intentionally empty.
 
+    def reset(self, initial_value=None):
+        """Empties the stream so it can be reused, optionally with new content."""
+        # New content is encoded straight into the buffer, instead of being
+        # written through the text layer and then seeking back to the start.
+        self.seek(0)
+        self.truncate()
+        if initial_value:
+            self._buffer.write(initial_value.encode(self.encoding))
+            self._buffer.seek(0)
+
     def get_value(self) -> str:
         """Returns value from the buffer as string."""
-        self.seek(0)
-        return self.read()
+        # Decode the whole buffer at once, rather than seeking back and reading
+        # it through the text layer.
+        self.flush()
+        value = self._buffer.getvalue().decode(self.encoding)
+        if self._translate_newlines and "\r" in value:
+            # Match the universal newlines mode used when reading.
+            value = value.replace("\r\n", "\n").replace("\r", "\n")
+        return value
+
+
+# Streams used to replace stdio, kept per thread and reused between runs.
+_THREAD_STREAMS = threading.local()
+
+
+def _get_streams(
+    use_stdin: bool, source: str = None
+) -> Tuple[CustomIO, CustomIO, CustomIO | None]:
+    """Returns this thread's stdout, stderr and stdin streams, emptied."""
+    streams = getattr(_THREAD_STREAMS, "streams", None)
+    if streams is None:
+        streams = (
+            CustomIO("<stdout>", encoding="utf-8"),
+            CustomIO("<stderr>", encoding="utf-8"),
+            CustomIO("<stdin>", encoding="utf-8", newline="\n"),
+        )
+        _THREAD_STREAMS.streams = streams
+
+    str_output, str_error, str_input = streams
+    str_output.reset()
+    str_error.reset()
+    if use_stdin and source is not None:
+        str_input.reset(source)
+        return str_output, str_error, str_input
+    return str_output, str_error, None
 
 
 @contextlib.contextmanager
@@ -121,12 +188,16 @@ def substitute_attr(obj: Any, attribute: str, new_value: Any):
 
 
 @contextlib.contextmanager
-def redirect_io(stream: str, new_stream):
-    """Redirect stdio streams to a custom stream."""
-    old_stream = getattr(sys, stream)
-    setattr(sys, stream, new_stream)
-    yield
-    setattr(sys, stream, old_stream)
+def redirect_sys(argv: Sequence[str], stdout, stderr, stdin=None):
+    """Substitute `sys.argv` and redirect stdio streams in one step."""
+    old_values = (sys.argv, sys.stdout, sys.stderr, sys.stdin)
+    sys.argv, sys.stdout, sys.stderr = argv, stdout, stderr
+    if stdin is not None:
+        sys.stdin = stdin
+    try:
+        yield
+    finally:
+        sys.argv, sys.stdout, sys.stderr, sys.stdin = old_values
 
 
 @contextlib.contextmanager
@@ -141,21 +212,16 @@ def _run_module(
     module: str, argv: Sequence[str], use_stdin: bool, source: str = None
 ) -> RunResult:
     """Runs as a module."""
-    str_output = CustomIO("<stdout>", encoding="utf-8")
-    str_error = CustomIO("<stderr>", encoding="utf-8")
+    str_output, str_error, str_input = _get_streams(use_stdin, source)
 
     try:
-        with substitute_attr(sys, "argv", argv):
-            with redirect_io("stdout", str_output):
-                with redirect_io("stderr", str_error):
-                    if use_stdin and source is not None:
-                        str_input = CustomIO("<stdin>", encoding="utf-8", newline="\n")
-                        with redirect_io("stdin", str_input):
-                            str_input.write(source)
-                            str_input.seek(0)
-                            runpy.run_module(module, run_name="__main__")
-                    else:
-                        runpy.run_module(module, run_name="__main__")
+        with redirect_sys(argv, str_output, str_error, str_input):
+            if module in MAIN_FUNCTIONS:
+                module_name, function_name = MAIN_FUNCTIONS[module]
+                main = getattr(importlib.import_module(module_name), function_name)
+                main()
+            else:
+                runpy.run_module(module, run_name="__main__")
     except SystemExit:
         pass
 
@@ -220,21 +286,15 @@ def _run_api(
     use_stdin: bool,
     source: str = None,
 ) -> RunResult:
-    str_output = CustomIO("<stdout>", encoding="utf-8")
-    str_error = CustomIO("<stderr>", encoding="utf-8")
+    str_output, str_error, str_input = _get_streams(use_stdin, source)
 
     try:
-        with substitute_attr(sys, "argv", argv):
-            with redirect_io("stdout", str_output):
-                with redirect_io("stderr", str_error):
-                    if use_stdin and source is not None:
-                        str_input = CustomIO("<stdin>", encoding="utf-8", newline="\n")
-                        with redirect_io("stdin", str_input):
-                            str_input.write(source)
-                            str_input.seek(0)
-                            callback(argv, str_output, str_error, str_input)
-                    else:
-                        callback(argv, str_output, str_error)
+        if str_input is not None:
+            with redirect_sys(argv, str_output, str_error, str_input):
+                callback(argv, str_output, str_error, str_input)
+        else:
+            with redirect_sys(argv, str_output, str_error):
+                callback(argv, str_output, str_error)
     except SystemExit:
         pass
 
@@ -1,23 +1,48 @@
 # Copyright (c) Microsoft Corporation. All rights reserved.
 # Licensed under the MIT License.
 """All the action we need during build"""
-import io
+import concurrent.futures
+import functools
+import gzip
+import hashlib
 import json
 import os
 import pathlib
 import re
+import shutil
+import tempfile
+import urllib.error
 import urllib.request as url_lib
 import zipfile
-from typing import List, Optional, Union
+from typing import Dict, List, Optional, Union
 
 import nox  # pylint: disable=import-error
 
+# Registry responses from earlier runs, revalidated with ETag/Last-Modified.
+HTTP_CACHE_DIR = pathlib.Path.home() / ".cache" / "vscode-black-formatter" / "http"
+
+README_VERSION_RE = re.compile(
+    r"\`([a-zA-Z0-9]+)=([0-9]+\.[0-9]+\.[0-9]+)\`", re.MULTILINE
+)
+VERSION_SEPARATOR_RE = re.compile("\\.|-")
+
+WHEEL_SPOOL_SIZE = 1 << 20
+
+BUNDLE_SENTINEL = ".requirements.sha256"
+
 
 def _install_bundle(session: nox.Session) -> None:
+    requirements_file = pathlib.Path(__file__).parent / "requirements.txt"
+    requirements_hash = hashlib.sha256(requirements_file.read_bytes()).hexdigest()
+    # Written after a successful install so unchanged requirements are skipped.
+    sentinel = pathlib.Path(__file__).parent / "bundled" / "libs" / BUNDLE_SENTINEL
+    if sentinel.exists() and sentinel.read_text(encoding="utf-8") == requirements_hash:
+        session.log("Bundled libraries are up to date with requirements.txt")
+        return
+
     session.install(
         "-t",
         "./bundled/libs",
-        "--no-cache-dir",
         "--implementation",
         "py",
         "--no-deps",
@@ -25,14 +50,15 @@ def _install_bundle(session: nox.Session) -> None:
         "-r",
         "./requirements.txt",
     )
+    sentinel.write_text(requirements_hash, encoding="utf-8")
 
 
 def _check_files(names: List[str]) -> None:
     root_dir = pathlib.Path(__file__).parent
     for name in names:
         file_path = root_dir / name
-        lines: List[str] = file_path.read_text().splitlines()
-        if any(line for line in lines if line.startswith("# TODO:")):
+        text = file_path.read_text()
+        if text.startswith("# TODO:") or "\n# TODO:" in text:
             raise Exception(f"Please update {os.fspath(file_path)}.")
 
 
@@ -51,12 +77,60 @@ def _update_pip_packages(session: nox.Session) -> None:
         "--upgrade",
         "./src/test/python_tests/requirements.in",
     )
+    # The pinned versions may have changed.
+    _get_requirement_versions.cache_clear()
+
+
+def _read_url(url: str, headers: Optional[Dict[str, str]] = None) -> bytes:
+    """Reads the url, reusing the copy from an earlier run if it is unchanged."""
+    headers = dict(headers or {})
+    key = hashlib.sha256(json.dumps([url, headers]).encode("utf-8")).hexdigest()
+    body_path = HTTP_CACHE_DIR / key
+    validators_path = HTTP_CACHE_DIR / f"{key}.json"
+
+    cached = body_path.exists() and validators_path.exists()
+    if cached:
+        validators = json.loads(validators_path.read_bytes())
+        if "ETag" in validators:
+            headers["If-None-Match"] = validators["ETag"]
+        if "Last-Modified" in validators:
+            headers["If-Modified-Since"] = validators["Last-Modified"]
+
+    try:
+        with url_lib.urlopen(url_lib.Request(url, headers=headers)) as response:
+            data = response.read()
+            if response.headers.get("Content-Encoding") == "gzip":
+                data = gzip.decompress(data)
+            validators = {
+                name: response.headers[name]
+                for name in ("ETag", "Last-Modified")
+                if name in response.headers
+            }
+    except urllib.error.HTTPError as error:
+        if cached and error.code == 304:
+            return body_path.read_bytes()
+        raise
+
+    if validators:
+        HTTP_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        body_path.write_bytes(data)
+        validators_path.write_text(json.dumps(validators), encoding="utf-8")
+    return data
 
 
 def _get_package_data(package):
     json_uri = f"https://registry.npmjs.org/{package}"
-    with url_lib.urlopen(json_uri) as response:
-        return json.loads(response.read())
+    # The abbreviated metadata used by `npm install` still has `dist-tags`, and
+    # is a fraction of the size of the full document.
+    return json.loads(
+        _read_url(
+            json_uri,
+            headers={
+                "Accept": "application/vnd.npm.install-v1+json",
+                "Accept-Encoding": "gzip",
+            },
+        )
+    )
 
 
 def _update_npm_packages(session: nox.Session) -> None:
@@ -67,19 +141,34 @@ def _update_npm_packages(session: nox.Session) -> None:
         "chai",
     }
     package_json_path = pathlib.Path(__file__).parent / "package.json"
-    package_json = json.loads(package_json_path.read_text(encoding="utf-8"))
-
-    for package in package_json["dependencies"]:
-        if package not in pinned:
-            data = _get_package_data(package)
-            latest = "^" + data["dist-tags"]["latest"]
-            package_json["dependencies"][package] = latest
+    package_json = _get_package_json()
+
+    # Registry lookups only wait on the network, so run them all at once.
+    dependency_types = ("dependencies", "devDependencies")
+    packages = sorted(
+        {
+            package
+            for dependency_type in dependency_types
+            for package in package_json[dependency_type]
+            if package not in pinned
+        }
+    )
+    with concurrent.futures.ThreadPoolExecutor(max_workers=16) as executor:
+        latest_versions = dict(
+            zip(
+                packages,
+                executor.map(
+                    lambda package: _get_package_data(package)["dist-tags"]["latest"],
+                    packages,
+                ),
+            )
+        )
 
-    for package in package_json["devDependencies"]:
-        if package not in pinned:
-            data = _get_package_data(package)
-            latest = "^" + data["dist-tags"]["latest"]
-            package_json["devDependencies"][package] = latest
+    for dependency_type in dependency_types:
+        for package in package_json[dependency_type]:
+            if package not in pinned:
+                latest = "^" + latest_versions[package]
+                package_json[dependency_type][package] = latest
 
     # Ensure engine matches the package
     if (
@@ -123,9 +212,10 @@ def setup(session: nox.Session) -> None:
 def tests(session: nox.Session) -> None:
     """Runs all the tests for the extension."""
     session.install("-r", "src/test/python_tests/requirements.txt")
-    session.run("pytest", "src/test/python_tests")
 
-    session.install("freezegun")
+    # Each worker starts its own language server, so tests run in parallel.
+    session.run("pytest", "-n", "auto", "src/test/python_tests")
+
     session.run("pytest", "build")
 
 
@@ -185,9 +275,9 @@ def update_build_number(session: nox.Session) -> None:
     package_json_path = pathlib.Path(__file__).parent / "package.json"
     session.log(f"Reading package.json at: {package_json_path}")
 
-    package_json = json.loads(package_json_path.read_text(encoding="utf-8"))
+    package_json = _get_package_json()
 
-    parts = re.split("\\.|-", package_json["version"])
+    parts = VERSION_SEPARATOR_RE.split(package_json["version"])
     major, minor = parts[:2]
 
     version = f"{major}.{minor}.{session.posargs[0]}"
@@ -198,20 +288,36 @@ def update_build_number(session: nox.Session) -> None:
     package_json_path.write_text(json.dumps(package_json, indent=4), encoding="utf-8")
 
 
-def _get_module_name() -> str:
+@functools.lru_cache(maxsize=1)
+def _get_package_json() -> dict:
+    """Returns the parsed package.json, read once per nox run.
+
+    Sessions that update package.json change this dict before writing it, so it
+    stays in step with the file.
+    """
     package_json_path = pathlib.Path(__file__).parent / "package.json"
-    package_json = json.loads(package_json_path.read_text(encoding="utf-8"))
-    return package_json["serverInfo"]["module"]
+    return json.loads(package_json_path.read_bytes())
 
 
-def _get_version(module: str) -> Union[str, None]:
+def _get_module_name() -> str:
+    return _get_package_json()["serverInfo"]["module"]
+
+
+@functools.lru_cache(maxsize=1)
+def _get_requirement_versions() -> Dict[str, str]:
+    """Returns the pinned version of each package in 'requirements.txt'."""
     requirements_file = pathlib.Path(__file__).parent / "requirements.txt"
     lines = requirements_file.read_text(encoding="utf-8").splitlines(keepends=False)
+    versions = {}
     for line in lines:
-        if line.startswith(module):
-            _, version = line.split(" ")[0].split("==")
-            return version
-    return None
+        if "==" in line and not line.startswith((" ", "#")):
+            name, version = line.split(" ")[0].split("==")
+            versions[name] = version
+    return versions
+
+
+def _get_version(module: str) -> Union[str, None]:
+    return _get_requirement_versions().get(module)
 
 
 @nox.session()
@@ -231,16 +337,12 @@ def validate_readme(session: nox.Session) -> None:
 
 
 def _update_readme() -> None:
-    requirements_file = pathlib.Path(__file__).parent / "requirements.txt"
-    lines = requirements_file.read_text(encoding="utf-8").splitlines(keepends=False)
     module = _get_module_name()
-    formatter_ver = list(line for line in lines if line.startswith(module))[0]
-    _, version = formatter_ver.split(" ")[0].split("==")
+    version = _get_version(module)
 
     readme_file = pathlib.Path(__file__).parent / "README.md"
     content = readme_file.read_text(encoding="utf-8")
-    regex = r"\`([a-zA-Z0-9]+)=([0-9]+\.[0-9]+\.[0-9]+)\`"
-    result = re.sub(regex, f"`{module}={version}`", content, 0, re.MULTILINE)
+    result = README_VERSION_RE.sub(f"`{module}={version}`", content)
     content = readme_file.write_text(result, encoding="utf-8")
 
 
@@ -262,8 +364,7 @@ def _get_pypi_package_data(package_name):
     json_uri = "https://pypi.org/pypi/{0}/json".format(package_name)
     # Response format: https://warehouse.readthedocs.io/api-reference/json/#project
     # Release metadata format: https://github.com/pypa/interoperability-peps/blob/master/pep-0426-core-metadata.rst
-    with url_lib.urlopen(json_uri) as response:
-        return json.loads(response.read())
+    return json.loads(_read_url(json_uri))
 
 
 def _get_wheel_urls(data, version):
@@ -276,9 +377,14 @@ def _download_and_extract(root, url):
     if "manylinux" in url or "macosx" in url or "win_amd64" in url:
         root = os.getcwd() if root is None or root == "." else root
         print(url)
-        with url_lib.urlopen(url) as response:
-            data = response.read()
-            with zipfile.ZipFile(io.BytesIO(data), "r") as wheel:
+        # Small wheels stay in memory, large ones are spooled to disk so the
+        # whole download is never held in memory at once.
+        with url_lib.urlopen(url) as response, tempfile.SpooledTemporaryFile(
+            max_size=WHEEL_SPOOL_SIZE
+        ) as data:
+            shutil.copyfileobj(response, data, WHEEL_SPOOL_SIZE)
+            data.seek(0)
+            with zipfile.ZipFile(data, "r") as wheel:
                 for zip_info in wheel.infolist():
                     # Ignore dist info since we are merging multiple wheels
                     if ".dist-info/" in zip_info.filename:
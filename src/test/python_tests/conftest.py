@@ -0,0 +1,42 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+"""
+Shared fixtures for the LSP tests.
+"""
+import contextlib
+
+import pytest
+
+from .lsp_test_client import session, utils
+
+
+@pytest.fixture(scope="session")
+def ls_session():
+    """Returns a language server session initialized with the default settings.
+
+    Starting and initializing the server takes most of the time of a test, so
+    the tests share one session. With pytest-xdist each worker has its own.
+    """
+    with session.LspSession() as lsp_session:
+        lsp_session.initialize()
+        yield lsp_session
+
+
+@pytest.fixture(scope="module")
+def sample_file_copy():
+    """Returns a function that copies a test data file next to the original and
+    returns the `utils.PythonFile` for the copy.
+
+    Each file is copied once per module and the copies are removed afterwards.
+    """
+    with contextlib.ExitStack() as stack:
+        copies = {}
+
+        def _copy(source):
+            if source not in copies:
+                copies[source] = stack.enter_context(
+                    utils.python_file(utils.read_text(source), source.parent)
+                )
+            return copies[source]
+
+        yield _copy
@@ -217,3 +217,17 @@ VSCODE_DEFAULT_INITIALIZE = {
     "workspaceFolders": [{"uri": as_uri(str(PROJECT_ROOT)), "name": "my_project"}],
     "initializationOptions": get_initialization_options(),
 }
+
+
+def clone_initialize(**setting_overrides):
+    """Returns the default initialize params with workspace settings overridden.
+
+    Only the settings are copied; the rest is shared with
+    `VSCODE_DEFAULT_INITIALIZE` and must not be changed.
+    """
+    init_options = VSCODE_DEFAULT_INITIALIZE["initializationOptions"]
+    setting = {**init_options["settings"][0], **setting_overrides}
+    return {
+        **VSCODE_DEFAULT_INITIALIZE,
+        "initializationOptions": {"settings": [setting], "globalSettings": setting},
+    }
@@ -3,27 +3,34 @@
 """
 Utility functions for use with tests.
 """
+import array
 import contextlib
+import functools
+import itertools
 import json
-import os
 import pathlib
 import platform
-import random
+import re
 import subprocess
 import sys
-from typing import Any, List
+import tempfile
+from typing import Any, List, NamedTuple
 
 import lsprotocol.converters as cv
 import lsprotocol.types as lsp
 
 from .constants import PROJECT_ROOT
 
+_IS_WINDOWS = platform.system() == "Windows"
+
+# Lines are split the same way as `str.splitlines`, which `get_text_edits` uses
+# and which also breaks lines at characters like form feeds.
+_LINE_BREAK_RE = re.compile("\r\n|[\n\r\x0b\x0c\x1c\x1d\x1e\x85\u2028\u2029]")
+
 
 def normalizecase(path: str) -> str:
     """Fixes 'file' uri or path case for easier testing in windows."""
-    if platform.system() == "Windows":
-        return path.lower()
-    return path
+    return path.lower() if _IS_WINDOWS else path
 
 
 def as_uri(path: str) -> str:
@@ -31,59 +38,77 @@ def as_uri(path: str) -> str:
     return normalizecase(pathlib.Path(path).as_uri())
 
 
+@functools.lru_cache(maxsize=None)
+def read_text(path: pathlib.Path) -> str:
+    """Returns the text of a test data file, read once per test run."""
+    return path.read_text(encoding="utf-8")
+
+
+class PythonFile(NamedTuple):
+    """A temporary python file and its 'file' uri."""
+
+    path: pathlib.Path
+    uri: str
+
+
 @contextlib.contextmanager
 def python_file(contents: str, root: pathlib.Path):
+    with tempfile.NamedTemporaryFile(
+        "w", dir=root, suffix=".py", delete=False, encoding="utf-8"
+    ) as file:
+        file.write(contents)
+    fullpath = pathlib.Path(file.name)
     try:
-        basename = (
-            "".join(random.choice("abcdefghijklmnopqrstuvwxyz") for _ in range(9))
-            + ".py"
-        )
-        fullpath = root / basename
-        fullpath.write_text(contents, encoding="utf-8")
-        yield fullpath
+        yield PythonFile(fullpath, as_uri(str(fullpath)))
     finally:
-        os.unlink(str(fullpath))
+        fullpath.unlink(missing_ok=True)
+
+
+# Skips pip's self version check and any prompts, which only slow tests down.
+_PIP = [sys.executable, "-m", "pip", "--disable-pip-version-check", "--no-input"]
 
 
 @contextlib.contextmanager
 def install_packages(packages: List[str]):
     try:
-        subprocess.run([sys.executable, "-m", "pip", "install"] + packages, check=True)
+        subprocess.run(_PIP + ["install", "--quiet"] + packages, check=True)
         yield
     finally:
         try:
-            subprocess.run(
-                [sys.executable, "-m", "pip", "uninstall", "-y"] + packages, check=True
-            )
+            subprocess.run(_PIP + ["uninstall", "--quiet", "-y"] + packages, check=True)
         except Exception:
             pass
 
 
+@functools.lru_cache(maxsize=1)
+def _load_package_json() -> dict:
+    """Returns the parsed package.json, read once per test run."""
+    package_json_path = PROJECT_ROOT / "package.json"
+    return json.loads(package_json_path.read_bytes())
+
+
 def get_server_info_defaults():
     """Returns server info from package.json"""
-    package_json_path = PROJECT_ROOT / "package.json"
-    package_json = json.loads(package_json_path.read_text())
-    return package_json["serverInfo"]
+    return dict(_load_package_json()["serverInfo"])
 
 
 def get_initialization_options():
     """Returns initialization options from package.json"""
-    package_json_path = PROJECT_ROOT / "package.json"
-    package_json = json.loads(package_json_path.read_text())
+    package_json = _load_package_json()
 
     server_info = package_json["serverInfo"]
     server_id = f"{server_info['module']}-formatter"
 
     properties = package_json["contributes"]["configuration"]["properties"]
-    setting = {}
-    for prop in properties:
-        name = prop[len(server_id) + 1 :]
-        value = properties[prop]["default"]
-        setting[name] = value
-
-    setting["workspace"] = as_uri(str(PROJECT_ROOT))
-    setting["interpreter"] = []
-    setting["cwd"] = str(PROJECT_ROOT)
+    prefix_length = len(server_id) + 1
+    setting = {
+        prop[prefix_length:]: value["default"] for prop, value in properties.items()
+    }
+    setting.update(
+        workspace=as_uri(str(PROJECT_ROOT)),
+        interpreter=[],
+        cwd=str(PROJECT_ROOT),
+    )
 
     return {"settings": [setting], "globalSettings": setting}
 
@@ -92,17 +117,32 @@ def apply_text_edits(text: str, text_edits: List[lsp.TextEdit]) -> str:
     if not text_edits:
         return text
 
-    offsets = [0]
-    for line in text.splitlines(keepends=True):
-        offsets.append(offsets[-1] + len(line))
-
-    for text_edit in reversed(text_edits):
+    # Only the lines up to the last one an edit touches are scanned. Offsets
+    # are packed machine integers rather than a list of int objects.
+    last_line = max(text_edit.range.end.line for text_edit in text_edits)
+    offsets = array.array("q", [0])
+    offsets.extend(
+        match.end()
+        for match in itertools.islice(_LINE_BREAK_RE.finditer(text), last_line)
+    )
+    if len(offsets) <= last_line:
+        # The edit ends after the last line break, at the end of the text.
+        offsets.append(len(text))
+
+    # Edits are in document order and do not overlap, so the result is built
+    # from the unchanged parts and the new text in one pass.
+    parts = []
+    position = 0
+    for text_edit in text_edits:
         start_offset = (
             offsets[text_edit.range.start.line] + text_edit.range.start.character
         )
         end_offset = offsets[text_edit.range.end.line] + text_edit.range.end.character
-        text = text[:start_offset] + text_edit.new_text + text[end_offset:]
-    return text
+        parts.append(text[position:start_offset])
+        parts.append(text_edit.new_text)
+        position = end_offset
+    parts.append(text[position:])
+    return "".join(parts)
 
 
 def destructure_text_edits(text_edits: List[Any]) -> List[lsp.TextEdit]:
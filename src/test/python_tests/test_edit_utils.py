@@ -10,7 +10,6 @@ import sys
 from typing import List
 
 import pytest
-from hamcrest import assert_that, is_
 from lsprotocol import types as lsp
 
 # From: src\test\python_tests\test_edit_utils.py
@@ -18,11 +17,20 @@ from lsprotocol import types as lsp
 UTILS_PATH = pathlib.Path(__file__).parent.parent.parent.parent / "bundled" / "tool"
 sys.path.append(os.fspath(UTILS_PATH))
 
+import lsp_edit_utils
 from lsp_edit_utils import get_text_edits
 
 from .lsp_test_client import constants, utils
 
 
+def _read_sample(name: str):
+    """Returns the unformatted and formatted text of a sample."""
+    sample_dir = constants.TEST_DATA / name
+    unformatted = utils.read_text(sample_dir / "sample.unformatted")
+    formatted = utils.read_text(sample_dir / "sample.py")
+    return unformatted, formatted
+
+
 @pytest.mark.parametrize(
     "encoding,expected",
     [
@@ -68,14 +76,10 @@ from .lsp_test_client import constants, utils
     ],
 )
 def test_with_emojis(encoding: lsp.PositionEncodingKind, expected: List[lsp.TextEdit]):
-    FORMATTED_TEST_FILE_PATH = constants.TEST_DATA / "sample6" / "sample.py"
-    UNFORMATTED_TEST_FILE_PATH = constants.TEST_DATA / "sample6" / "sample.unformatted"
-
-    formatted = FORMATTED_TEST_FILE_PATH.read_text(encoding="utf-8")
-    unformatted = UNFORMATTED_TEST_FILE_PATH.read_text(encoding="utf-8")
+    unformatted, formatted = _read_sample("sample6")
     actual = get_text_edits(unformatted, formatted, encoding, 4000)
 
-    assert_that(actual, is_(expected))
+    assert actual == expected
 
 
 @pytest.mark.parametrize(
@@ -123,27 +127,34 @@ def test_with_emojis(encoding: lsp.PositionEncodingKind, expected: List[lsp.Text
     ],
 )
 def test_with_emojis2(encoding: lsp.PositionEncodingKind, expected: List[lsp.TextEdit]):
-    FORMATTED_TEST_FILE_PATH = constants.TEST_DATA / "sample7" / "sample.py"
-    UNFORMATTED_TEST_FILE_PATH = constants.TEST_DATA / "sample7" / "sample.unformatted"
-
-    formatted = FORMATTED_TEST_FILE_PATH.read_text(encoding="utf-8")
-    unformatted = UNFORMATTED_TEST_FILE_PATH.read_text(encoding="utf-8")
+    unformatted, formatted = _read_sample("sample7")
     actual = get_text_edits(unformatted, formatted, encoding, 4000)
 
-    assert_that(actual, is_(expected))
+    assert actual == expected
 
 
 def test_large_edits():
-    FORMATTED_TEST_FILE_PATH = constants.TEST_DATA / "sample3" / "sample.py"
-    UNFORMATTED_TEST_FILE_PATH = constants.TEST_DATA / "sample3" / "sample.unformatted"
-
-    formatted = FORMATTED_TEST_FILE_PATH.read_text(encoding="utf-8")
-    unformatted = UNFORMATTED_TEST_FILE_PATH.read_text(encoding="utf-8")
+    unformatted, formatted = _read_sample("sample3")
 
     edits = get_text_edits(unformatted, formatted, lsp.PositionEncodingKind.Utf32, 4000)
 
     actual = utils.apply_text_edits(unformatted, edits)
-    assert_that(actual, is_(formatted))
+    assert actual == formatted
+
+
+def test_edit_between_common_prefix_and_suffix():
+    prefix = "import os\n" * 100
+    suffix = "print(os.getcwd())\n" * 100
+    unformatted = prefix + "x = {  'a':37,'b':42,\n'c':927}\n" + suffix
+    formatted = prefix + 'x = {"a": 37, "b": 42, "c": 927}\n' + suffix
+
+    edits = get_text_edits(unformatted, formatted, lsp.PositionEncodingKind.Utf16)
+
+    for edit in edits:
+        assert edit.range.start.line >= 100
+        assert edit.range.end.line <= 101
+    actual = utils.apply_text_edits(unformatted, edits)
+    assert actual == formatted
 
 
 def has_levenshtein():
@@ -157,16 +168,29 @@ def has_levenshtein():
 
 @pytest.mark.skipif(not has_levenshtein(), reason="Levenshtein is not installed")
 def test_with_levenshtein():
-    FORMATTED_TEST_FILE_PATH = constants.TEST_DATA / "sample3" / "sample.py"
-    UNFORMATTED_TEST_FILE_PATH = constants.TEST_DATA / "sample3" / "sample.unformatted"
+    unformatted, formatted = _read_sample("sample3")
+
+    # Levenshtein is already installed, installing and uninstalling it here
+    # would change the environment under the other pytest-xdist workers.
+    edits = get_text_edits(unformatted, formatted, lsp.PositionEncodingKind.Utf32, 4000)
+
+    actual = utils.apply_text_edits(unformatted, edits)
+    assert actual == formatted
+
+
+def test_with_levenshtein_over_size_limit(monkeypatch):
+    unformatted, formatted = _read_sample("sample3")
 
-    formatted = FORMATTED_TEST_FILE_PATH.read_text(encoding="utf-8")
-    unformatted = UNFORMATTED_TEST_FILE_PATH.read_text(encoding="utf-8")
+    class _Levenshtein:
+        @staticmethod
+        def opcodes(old_text, new_text):
+            raise AssertionError("Levenshtein should not run past the size limit")
 
-    with utils.install_packages(["Levenshtein"]):
-        edits = get_text_edits(
-            unformatted, formatted, lsp.PositionEncodingKind.Utf32, 4000
-        )
+    monkeypatch.setattr(lsp_edit_utils, "Levenshtein", _Levenshtein)
+    monkeypatch.setattr(lsp_edit_utils, "LEVENSHTEIN_MAX_SIZE", 1)
+    edits = get_text_edits(unformatted, formatted, lsp.PositionEncodingKind.Utf16)
 
+    assert len(edits) == 1
+    assert edits[0].range.start == lsp.Position(0, 0)
     actual = utils.apply_text_edits(unformatted, edits)
-    assert_that(actual, is_(formatted))
+    assert actual == formatted
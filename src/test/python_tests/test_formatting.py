@@ -3,72 +3,39 @@
 """
 Test for formatting over LSP.
 """
+import os
 import pathlib
 
 import pytest
-from hamcrest import assert_that, is_
 
-from .lsp_test_client import constants, session, utils
+from .lsp_test_client import constants, defaults, session, utils
 
 FORMATTER = utils.get_server_info_defaults()
+# Use any stdlib path here
+STDLIB_FILE_URI = utils.as_uri(pathlib.__file__)
+
+
+def _get_line(text: str, line: int) -> str:
+    """Returns a line of the text, without scanning past it."""
+    start = 0
+    for _ in range(line):
+        start = text.index("\n", start) + 1
+    end = text.find("\n", start)
+    return text[start : None if end == -1 else end].rstrip("\r")
 
 
 @pytest.mark.parametrize("sample", ["sample1", "sample3"])
-def test_formatting(sample: str):
+def test_formatting(ls_session, sample: str):
     """Test formatting a python file."""
     FORMATTED_TEST_FILE_PATH = constants.TEST_DATA / sample / "sample.py"
     UNFORMATTED_TEST_FILE_PATH = constants.TEST_DATA / sample / "sample.unformatted"
 
-    contents = UNFORMATTED_TEST_FILE_PATH.read_text(encoding="utf-8")
+    contents = utils.read_text(UNFORMATTED_TEST_FILE_PATH)
 
     actual = []
     with utils.python_file(contents, UNFORMATTED_TEST_FILE_PATH.parent) as pf:
-        uri = utils.as_uri(str(pf))
-
-        with session.LspSession() as ls_session:
-            ls_session.initialize()
-            ls_session.notify_did_open(
-                {
-                    "textDocument": {
-                        "uri": uri,
-                        "languageId": "python",
-                        "version": 1,
-                        "text": contents,
-                    }
-                }
-            )
-            actual = ls_session.text_document_formatting(
-                {
-                    "textDocument": {"uri": uri},
-                    # `options` is not used by black
-                    "options": {"tabSize": 4, "insertSpaces": True},
-                }
-            )
+        uri = pf.uri
 
-    expected_text = FORMATTED_TEST_FILE_PATH.read_text(encoding="utf-8")
-    actual_text = utils.apply_text_edits(contents, utils.destructure_text_edits(actual))
-    assert_that(actual_text, is_(expected_text))
-
-
-def test_formatting_cell():
-    """Test formating a python file."""
-    FORMATTED_TEST_FILE_PATH = constants.TEST_DATA / "sample2" / "sample.formatted"
-    UNFORMATTED_TEST_FILE_PATH = constants.TEST_DATA / "sample2" / "sample.unformatted"
-
-    contents = UNFORMATTED_TEST_FILE_PATH.read_text(encoding="utf-8")
-
-    actual = []
-
-    # generate a fake cell uri
-    uri = (
-        utils.as_uri(UNFORMATTED_TEST_FILE_PATH.parent / "sample.ipynb").replace(
-            "file:", "vscode-notebook-cell:"
-        )
-        + "#C00001"
-    )
-
-    with session.LspSession() as ls_session:
-        ls_session.initialize()
         ls_session.notify_did_open(
             {
                 "textDocument": {
@@ -87,58 +54,214 @@ def test_formatting_cell():
             }
         )
 
-    expected_text = FORMATTED_TEST_FILE_PATH.read_text(encoding="utf-8")
+    expected_text = utils.read_text(FORMATTED_TEST_FILE_PATH)
     actual_text = utils.apply_text_edits(contents, utils.destructure_text_edits(actual))
-    assert_that(actual_text, is_(expected_text))
+    assert actual_text == expected_text
 
 
-def test_skipping_site_packages_files():
-    """Test skipping formatting when the file is in site-packages"""
-
+def test_formatting_repeated(ls_session):
+    """Test formatting the same unchanged document twice."""
+    FORMATTED_TEST_FILE_PATH = constants.TEST_DATA / "sample1" / "sample.py"
     UNFORMATTED_TEST_FILE_PATH = constants.TEST_DATA / "sample1" / "sample.unformatted"
-    with session.LspSession() as ls_session:
-        # Use any stdlib path here
-        uri = utils.as_uri(pathlib.__file__)
-        ls_session.initialize()
+
+    contents = utils.read_text(UNFORMATTED_TEST_FILE_PATH)
+
+    results = []
+    with utils.python_file(contents, UNFORMATTED_TEST_FILE_PATH.parent) as pf:
+        uri = pf.uri
+
         ls_session.notify_did_open(
             {
                 "textDocument": {
                     "uri": uri,
                     "languageId": "python",
                     "version": 1,
-                    "text": UNFORMATTED_TEST_FILE_PATH.read_text(encoding="utf-8"),
+                    "text": contents,
                 }
             }
         )
+        for _ in range(2):
+            results.append(
+                ls_session.text_document_formatting(
+                    {
+                        "textDocument": {"uri": uri},
+                        # `options` is not used by black
+                        "options": {"tabSize": 4, "insertSpaces": True},
+                    }
+                )
+            )
 
-        actual = ls_session.text_document_formatting(
-            {
-                "textDocument": {"uri": uri},
-                # `options` is not used by black
-                "options": {"tabSize": 4, "insertSpaces": True},
-            }
+    expected_text = utils.read_text(FORMATTED_TEST_FILE_PATH)
+    for actual in results:
+        actual_text = utils.apply_text_edits(
+            contents, utils.destructure_text_edits(actual)
         )
+        assert actual_text == expected_text
+
 
-    expected = None
-    assert_that(actual, is_(expected))
+def test_formatting_cell(ls_session):
+    """Test formating a python file."""
+    FORMATTED_TEST_FILE_PATH = constants.TEST_DATA / "sample2" / "sample.formatted"
+    UNFORMATTED_TEST_FILE_PATH = constants.TEST_DATA / "sample2" / "sample.unformatted"
+
+    contents = utils.read_text(UNFORMATTED_TEST_FILE_PATH)
+
+    actual = []
+
+    # generate a fake cell uri
+    uri = (
+        utils.as_uri(UNFORMATTED_TEST_FILE_PATH.parent / "sample.ipynb").replace(
+            "file:", "vscode-notebook-cell:"
+        )
+        + "#C00001"
+    )
+
+    ls_session.notify_did_open(
+        {
+            "textDocument": {
+                "uri": uri,
+                "languageId": "python",
+                "version": 1,
+                "text": contents,
+            }
+        }
+    )
+    actual = ls_session.text_document_formatting(
+        {
+            "textDocument": {"uri": uri},
+            # `options` is not used by black
+            "options": {"tabSize": 4, "insertSpaces": True},
+        }
+    )
+
+    expected_text = utils.read_text(FORMATTED_TEST_FILE_PATH)
+    actual_text = utils.apply_text_edits(contents, utils.destructure_text_edits(actual))
+    assert actual_text == expected_text
+
+
+def test_skipping_site_packages_files(ls_session):
+    """Test skipping formatting when the file is in site-packages"""
+
+    UNFORMATTED_TEST_FILE_PATH = constants.TEST_DATA / "sample1" / "sample.unformatted"
+    uri = STDLIB_FILE_URI
+    ls_session.notify_did_open(
+        {
+            "textDocument": {
+                "uri": uri,
+                "languageId": "python",
+                "version": 1,
+                "text": utils.read_text(UNFORMATTED_TEST_FILE_PATH),
+            }
+        }
+    )
+
+    actual = ls_session.text_document_formatting(
+        {
+            "textDocument": {"uri": uri},
+            # `options` is not used by black
+            "options": {"tabSize": 4, "insertSpaces": True},
+        }
+    )
+    # The session is shared, so do not leave the stdlib file open in it.
+    ls_session.notify_did_close({"textDocument": {"uri": uri}})
+
+    assert actual is None
 
 
 @pytest.mark.parametrize(
     "sample, ranges", [("sample4", "single-range"), ("sample5", "multi-range")]
 )
-def test_range_formatting(sample: str, ranges: str):
+def test_range_formatting(ls_session, sample: str, ranges: str):
     """Test formatting a python file."""
     FORMATTED_TEST_FILE_PATH = constants.TEST_DATA / sample / "sample.py"
     UNFORMATTED_TEST_FILE_PATH = constants.TEST_DATA / sample / "sample.unformatted"
 
-    contents = UNFORMATTED_TEST_FILE_PATH.read_text(encoding="utf-8")
-    lines = contents.splitlines()
+    contents = utils.read_text(UNFORMATTED_TEST_FILE_PATH)
 
     actual = []
     with utils.python_file(contents, UNFORMATTED_TEST_FILE_PATH.parent) as pf:
-        uri = utils.as_uri(str(pf))
+        uri = pf.uri
+
+        ls_session.notify_did_open(
+            {
+                "textDocument": {
+                    "uri": uri,
+                    "languageId": "python",
+                    "version": 1,
+                    "text": contents,
+                }
+            }
+        )
+
+        if ranges == "single-range":
+            actual = ls_session.text_document_range_formatting(
+                {
+                    "textDocument": {"uri": uri},
+                    # `options` is not used by black
+                    "options": {"tabSize": 4, "insertSpaces": True},
+                    "range": {
+                        "start": {"line": 0, "character": 0},
+                        "end": {
+                            "line": 0,
+                            "character": len(_get_line(contents, 0)),
+                        },
+                    },
+                }
+            )
+        else:
+            actual = ls_session.text_document_ranges_formatting(
+                {
+                    "textDocument": {"uri": uri},
+                    # `options` is not used by black
+                    "options": {"tabSize": 4, "insertSpaces": True},
+                    "ranges": [
+                        {
+                            "start": {"line": 0, "character": 0},
+                            "end": {
+                                "line": 0,
+                                "character": len(_get_line(contents, 0)),
+                            },
+                        },
+                        {
+                            "start": {"line": 2, "character": 0},
+                            "end": {
+                                "line": 2,
+                                "character": len(_get_line(contents, 2)),
+                            },
+                        },
+                    ],
+                }
+            )
+
+    expected_text = utils.read_text(FORMATTED_TEST_FILE_PATH)
+    actual_text = utils.apply_text_edits(contents, utils.destructure_text_edits(actual))
+    assert actual_text == expected_text
+
+
+def test_formatting_symlinked_file(tmp_path: pathlib.Path):
+    """Test that a symlinked file in the workspace uses the workspace settings."""
+    UNFORMATTED_TEST_FILE_PATH = constants.TEST_DATA / "sample1" / "sample.unformatted"
+
+    contents = utils.read_text(UNFORMATTED_TEST_FILE_PATH)
+    # The target is outside the workspace, only the link is inside it.
+    target = tmp_path / "sample.py"
+    target.write_text(contents, encoding="utf-8")
+    link = UNFORMATTED_TEST_FILE_PATH.parent / f"{tmp_path.name}_link.py"
+    try:
+        os.symlink(target, link)
+    except OSError:
+        pytest.skip("Creating symlinks is not supported here")
+
+    cwd_messages = []
 
+    def _log_cwd(params):
+        if params["message"].startswith("CWD formatter: "):
+            cwd_messages.append(params["message"])
+
+    try:
+        uri = utils.as_uri(str(link))
         with session.LspSession() as ls_session:
+            ls_session.set_notification_callback(session.WINDOW_LOG_MESSAGE, _log_cwd)
             ls_session.initialize()
             ls_session.notify_did_open(
                 {
@@ -150,38 +273,66 @@ def test_range_formatting(sample: str, ranges: str):
                     }
                 }
             )
+            ls_session.text_document_formatting(
+                {
+                    "textDocument": {"uri": uri},
+                    # `options` is not used by black
+                    "options": {"tabSize": 4, "insertSpaces": True},
+                }
+            )
+    finally:
+        link.unlink()
 
-            if ranges == "single-range":
-                actual = ls_session.text_document_range_formatting(
-                    {
-                        "textDocument": {"uri": uri},
-                        # `options` is not used by black
-                        "options": {"tabSize": 4, "insertSpaces": True},
-                        "range": {
-                            "start": {"line": 0, "character": 0},
-                            "end": {"line": 0, "character": len(lines[0])},
-                        },
-                    }
-                )
-            else:
-                actual = ls_session.text_document_ranges_formatting(
-                    {
-                        "textDocument": {"uri": uri},
-                        # `options` is not used by black
-                        "options": {"tabSize": 4, "insertSpaces": True},
-                        "ranges": [
-                            {
-                                "start": {"line": 0, "character": 0},
-                                "end": {"line": 0, "character": len(lines[0])},
-                            },
-                            {
-                                "start": {"line": 2, "character": 0},
-                                "end": {"line": 2, "character": len(lines[2])},
-                            },
-                        ],
+    # Files outside any workspace are formatted from their own folder, files in
+    # the workspace from the `cwd` set in the workspace settings. The version
+    # check at start up is also run from the workspace `cwd`.
+    assert cwd_messages
+    assert set(cwd_messages) == {f"CWD formatter: {constants.PROJECT_ROOT}"}
+
+
+def test_formatting_after_config_change(tmp_path: pathlib.Path):
+    """Test that editing a `--config` file is picked up for an unchanged file."""
+    config = tmp_path / "pyproject.toml"
+    config.write_text("[tool.black]\nline-length = 88\n", encoding="utf-8")
+    init_params = defaults.clone_initialize(args=["--config", str(config)])
+
+    contents = "x = [1111, 2222, 3333]\ny = 'a'\n"
+    results = []
+    with utils.python_file(contents, constants.TEST_DATA / "sample1") as pf:
+        formatting_params = {
+            "textDocument": {"uri": pf.uri},
+            # `options` is not used by black
+            "options": {"tabSize": 4, "insertSpaces": True},
+        }
+        with session.LspSession() as ls_session:
+            ls_session.initialize(init_params)
+            ls_session.notify_did_open(
+                {
+                    "textDocument": {
+                        "uri": pf.uri,
+                        "languageId": "python",
+                        "version": 1,
+                        "text": contents,
                     }
-                )
+                }
+            )
+            results.append(ls_session.text_document_formatting(formatting_params))
 
-    expected_text = FORMATTED_TEST_FILE_PATH.read_text(encoding="utf-8")
-    actual_text = utils.apply_text_edits(contents, utils.destructure_text_edits(actual))
-    assert_that(actual_text, is_(expected_text))
+            config.write_text(
+                "[tool.black]\nline-length = 10\nskip-string-normalization = true\n",
+                encoding="utf-8",
+            )
+            # Make sure the modified time changes on file systems with a coarse
+            # timestamp resolution.
+            stat = config.stat()
+            os.utime(config, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+            results.append(ls_session.text_document_formatting(formatting_params))
+
+    assert results[0] is not None
+    assert results[1] is not None
+    first, second = (
+        utils.apply_text_edits(contents, utils.destructure_text_edits(result))
+        for result in results
+    )
+    assert first == 'x = [1111, 2222, 3333]\ny = "a"\n'
+    assert second == "x = [\n    1111,\n    2222,\n    3333,\n]\ny = 'a'\n"
@@ -2,13 +2,10 @@
 Test for path and interpreter settings.
 """
 
-import copy
 import os
 import pathlib
 import sys
 
-from hamcrest import assert_that, is_
-
 from .lsp_test_client import constants, defaults, session, utils
 
 FORMATTER = utils.get_server_info_defaults()
@@ -31,114 +28,114 @@ class CallbackObject:
 
     def check_for_argv_duplication(self, argv):
         """checks if argv duplication exists and sets result boolean"""
-        message = argv["message"].split()
-        duplicate_stdin = message.count("--stdin-filename") > 1
-        duplicate_version = "--version" in message and "--stdin-filename" in message
+        if self.result:
+            return
+        # argv is logged space separated; padding the message with spaces lets
+        # whole arguments be matched without splitting it into a list.
+        message = f" {argv['message']} "
+        stdin_count = message.count(" --stdin-filename ")
+        duplicate_stdin = stdin_count > 1
+        duplicate_version = stdin_count > 0 and " --version " in message
         if argv["type"] == 4 and (duplicate_stdin or duplicate_version):
             self.result = True
 
 
-def test_path():
+def test_path(sample_file_copy):
     """Test linting using pylint bin path set."""
 
-    init_params = copy.deepcopy(defaults.VSCODE_DEFAULT_INITIALIZE)
-    init_params["initializationOptions"]["settings"][0]["path"] = [
-        sys.executable,
-        os.fspath(UTILS_PATH),
-    ]
+    init_params = defaults.clone_initialize(
+        path=[sys.executable, os.fspath(UTILS_PATH)]
+    )
 
     argv_callback_object = CallbackObject()
-    contents = TEST_FILE.read_text()
+    contents = utils.read_text(TEST_FILE)
 
     actual = []
-    with utils.python_file(contents, TEST_FILE.parent) as file:
-        uri = utils.as_uri(str(file))
-
-        with session.LspSession() as ls_session:
-            ls_session.set_notification_callback(
-                session.WINDOW_LOG_MESSAGE,
-                argv_callback_object.check_for_argv_duplication,
-            )
-
-            ls_session.initialize(init_params)
-            ls_session.notify_did_open(
-                {
-                    "textDocument": {
-                        "uri": uri,
-                        "languageId": "python",
-                        "version": 1,
-                        "text": contents,
-                    }
+    uri = sample_file_copy(TEST_FILE).uri
+
+    with session.LspSession() as ls_session:
+        ls_session.set_notification_callback(
+            session.WINDOW_LOG_MESSAGE,
+            argv_callback_object.check_for_argv_duplication,
+        )
+
+        ls_session.initialize(init_params)
+        ls_session.notify_did_open(
+            {
+                "textDocument": {
+                    "uri": uri,
+                    "languageId": "python",
+                    "version": 1,
+                    "text": contents,
                 }
-            )
-
-            # Call this second time to detect arg duplication.
-            ls_session.notify_did_open(
-                {
-                    "textDocument": {
-                        "uri": uri,
-                        "languageId": "python",
-                        "version": 1,
-                        "text": contents,
-                    }
+            }
+        )
+
+        # Call this second time to detect arg duplication.
+        ls_session.notify_did_open(
+            {
+                "textDocument": {
+                    "uri": uri,
+                    "languageId": "python",
+                    "version": 1,
+                    "text": contents,
                 }
-            )
+            }
+        )
 
-            ls_session.text_document_formatting(
-                {
-                    "textDocument": {"uri": uri},
-                    # `options` is not used by black
-                    "options": {"tabSize": 4, "insertSpaces": True},
-                }
-            )
+        ls_session.text_document_formatting(
+            {
+                "textDocument": {"uri": uri},
+                # `options` is not used by black
+                "options": {"tabSize": 4, "insertSpaces": True},
+            }
+        )
 
-            actual = argv_callback_object.check_result()
+        actual = argv_callback_object.check_result()
 
-    assert_that(actual, is_(False))
+    assert not actual
 
 
-def test_interpreter():
+def test_interpreter(sample_file_copy):
     """Test linting using specific python path."""
-    init_params = copy.deepcopy(defaults.VSCODE_DEFAULT_INITIALIZE)
-    init_params["initializationOptions"]["settings"][0]["interpreter"] = ["python"]
+    init_params = defaults.clone_initialize(interpreter=["python"])
 
     argv_callback_object = CallbackObject()
-    contents = TEST_FILE.read_text()
+    contents = utils.read_text(TEST_FILE)
 
     actual = []
-    with utils.python_file(contents, TEST_FILE.parent) as file:
-        uri = utils.as_uri(str(file))
-
-        with session.LspSession() as ls_session:
-            ls_session.set_notification_callback(
-                session.WINDOW_LOG_MESSAGE,
-                argv_callback_object.check_for_argv_duplication,
-            )
-
-            ls_session.initialize(init_params)
-            ls_session.notify_did_open(
-                {
-                    "textDocument": {
-                        "uri": uri,
-                        "languageId": "python",
-                        "version": 1,
-                        "text": contents,
-                    }
+    uri = sample_file_copy(TEST_FILE).uri
+
+    with session.LspSession() as ls_session:
+        ls_session.set_notification_callback(
+            session.WINDOW_LOG_MESSAGE,
+            argv_callback_object.check_for_argv_duplication,
+        )
+
+        ls_session.initialize(init_params)
+        ls_session.notify_did_open(
+            {
+                "textDocument": {
+                    "uri": uri,
+                    "languageId": "python",
+                    "version": 1,
+                    "text": contents,
                 }
-            )
-
-            # Call this second time to detect arg duplication.
-            ls_session.notify_did_open(
-                {
-                    "textDocument": {
-                        "uri": uri,
-                        "languageId": "python",
-                        "version": 1,
-                        "text": contents,
-                    }
+            }
+        )
+
+        # Call this second time to detect arg duplication.
+        ls_session.notify_did_open(
+            {
+                "textDocument": {
+                    "uri": uri,
+                    "languageId": "python",
+                    "version": 1,
+                    "text": contents,
                 }
-            )
+            }
+        )
 
-            actual = argv_callback_object.check_result()
+        actual = argv_callback_object.check_result()
 
-    assert_that(actual, is_(False))
+    assert not actual